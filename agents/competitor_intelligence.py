@@ -1,13 +1,83 @@
+import hashlib
 import logging
-from typing import Dict, Any, List
+import re
+from collections import Counter
+from typing import Dict, Any, Iterator, List
 import anthropic
 import json
-from urllib.parse import urlparse
+import numpy as np
+from functools import lru_cache
+from itertools import chain, islice
+from urllib.parse import urlsplit
 
+from agents.llm_utils import get_client, inference_options
+from utils.cache import TTLCache
 from utils.product_cleaner import dedupe_products
 
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is the fallback
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# First numeric run in a price string, e.g. "£15.50 a month" -> "15.50"
+PRICE_RE = re.compile(r'[\d.]+')
+
+# Generated reports keyed by model + full prompt (the prompt embeds the analysis data)
+_REPORT_CACHE = TTLCache(maxsize=32)
+
+# Prepared analysis data keyed by a hash of the scraped input; read-only downstream, so not copied
+_ANALYSIS_CACHE = TTLCache(maxsize=8, copy_values=False)
+
+
+def _dumps(data: Any, indent: bool = False) -> str:
+    """Serialize analysis data for prompts, using orjson when it is installed."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, option=option, default=str).decode("utf-8")
+    if indent:
+        return json.dumps(data, indent=2, default=str)
+    return json.dumps(data, separators=(",", ":"), default=str, ensure_ascii=False)
+
+
+def _content_key(products_by_url: Dict[str, List[Dict[str, Any]]]) -> str:
+    """Stable hash of the scraped data, used to memoize analysis preparation."""
+    if orjson is not None:
+        payload = orjson.dumps(products_by_url, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    else:
+        payload = json.dumps(products_by_url, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def _domain(url: str) -> str:
+    """Lower-cased netloc of a URL; cached because the same URLs recur across reruns."""
+    return urlsplit(url).netloc.lower()
+
+
+# Product columns for the prompt table, in display order
+_PRODUCT_TABLE_FIELDS = (
+    "product_name",
+    "price_monthly",
+    "price_annual",
+    "excess",
+    "category",
+    "special_offers",
+    "terms_conditions",
+    "features",
+)
+
+
+def _table_cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        value = "; ".join(str(v) for v in value)
+    # Tabs/newlines would break the row layout
+    return " ".join(str(value).split())
+
+
 class CompetitorIntelligenceAgent:
     """
     Agent for generating competitive intelligence reports from scraped product data.
@@ -16,129 +86,188 @@ class CompetitorIntelligenceAgent:
     def __init__(self, api_key: str, model: str = "claude-sonnet-4-5-20250929"):
         self.api_key = api_key
         self.model = model
-        self.client = anthropic.Anthropic(api_key=api_key)
+        self.client = get_client(api_key)
     
-    def generate_report(self, products_by_url: Dict[str, List[Dict[str, Any]]]) -> str:
+    def generate_report(self, products_by_url: Dict[str, List[Dict[str, Any]]], use_cache: bool = True) -> str:
         """
         Generate a comprehensive competitor intelligence report from scraped data.
         """
+        return "".join(self.stream_report(products_by_url, use_cache=use_cache))
+
+    def stream_report(self, products_by_url: Dict[str, List[Dict[str, Any]]], use_cache: bool = True) -> Iterator[str]:
+        """
+        Stream the comprehensive report as it is generated (e.g. into `st.write_stream`).
+        With use_cache=False a fresh report is generated even if one is cached for the same data.
+        """
+        # Prepare data for analysis
+        report_data = self._prepare_data_for_analysis(products_by_url)
+        
+        # Create the analysis prompt
+        prompt = self._create_analysis_prompt(report_data)
+
+        yield from self._stream_completion(
+            prompt,
+            max_tokens=3000,
+            label="competitor intelligence report",
+            error_message="Error generating competitor intelligence report. Please try again.",
+            use_cache=use_cache,
+        )
+
+    def _stream_completion(
+        self, prompt: str, max_tokens: int, label: str, error_message: str, use_cache: bool = True
+    ) -> Iterator[str]:
+        """
+        Yield Claude's reply chunk by chunk, serving repeated prompts from the report cache.
+        use_cache=False skips the lookup (an explicit regenerate); the new reply replaces the cached one.
+        """
+        cache_key = TTLCache.make_key(self.model, prompt)
+        cached = _REPORT_CACHE.get(cache_key) if use_cache else None
+        if cached is not None:
+            logger.info(f"Using cached {label}")
+            yield cached
+            return
+
+        chunks: List[str] = []
         try:
-            # Prepare data for analysis
-            report_data = self._prepare_data_for_analysis(products_by_url)
-            
-            # Create the analysis prompt
-            prompt = self._create_analysis_prompt(report_data)
-            
-            # Call Claude to generate the report
-            message = self.client.messages.create(
+            with self.client.messages.stream(
                 model=self.model,
-                max_tokens=3000,
+                max_tokens=max_tokens,
                 messages=[
                     {"role": "user", "content": prompt}
-                ]
-            )
-            
-            report = message.content[0].text
-            logger.info("Successfully generated competitor intelligence report")
-            return report
-        
+                ],
+                **inference_options(),
+            ) as stream:
+                for text in stream.text_stream:
+                    chunks.append(text)
+                    yield text
         except anthropic.APIError as e:
-            logger.error(f"Error generating intelligence report: {e}")
-            return "Error generating competitor intelligence report. Please try again."
+            logger.error(f"Error generating {label}: {e}")
+            # Keep any partial text readable, then surface the error
+            yield ("\n\n" if chunks else "") + error_message
+            return
+
+        _REPORT_CACHE.set(cache_key, "".join(chunks))
+        logger.info(f"Successfully generated {label}")
     
     def _prepare_data_for_analysis(self, products_by_url: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
         """
         Prepare and structure data for analysis.
+        Memoized on the input's content, so generating both report types prepares it once.
         """
+        cache_key = _content_key(products_by_url or {})
+        cached = _ANALYSIS_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
         # Group by domain (provider) and aggregate products across multiple URLs.
         providers: Dict[str, Dict[str, Any]] = {}
 
         for url, products in (products_by_url or {}).items():
             if not products:
                 continue
-            domain = urlparse(url).netloc.lower()
+            domain = _domain(url)
             if domain not in providers:
-                providers[domain] = {"urls": [], "products": []}
+                providers[domain] = {"urls": [], "product_shards": []}
             providers[domain]["urls"].append(url)
-            providers[domain]["products"].extend(products)
-
-        analysis_data: Dict[str, Any] = {}
-        for domain, data in providers.items():
-            merged_products, dedupe_stats = dedupe_products(data["products"])
-            analysis_data[domain] = {
-                "provider_domain": domain,
-                "urls": data["urls"],
-                "product_count": len(merged_products),
-                "dedupe": dedupe_stats,
-                "products": merged_products,
-                "categories": self._extract_categories(merged_products),
-                "price_range": self._calculate_price_range(merged_products),
-                "unique_features": self._extract_unique_features(merged_products),
-                "is_british_gas": ("britishgas.co.uk" in domain),
-            }
+            # Keep per-URL lists as shards and flatten once, rather than growing one list
+            providers[domain]["product_shards"].append(products)
 
+        # Insertion order follows the input, which keeps the prompt (and the report cache key) deterministic
+        analysis_data = {domain: self._build_one_domain(domain, data) for domain, data in providers.items()}
+
+        _ANALYSIS_CACHE.set(cache_key, analysis_data)
         return analysis_data
     
+    def _build_one_domain(self, domain: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Dedupe and aggregate one provider's products."""
+        merged_products, dedupe_stats = dedupe_products(list(chain.from_iterable(data["product_shards"])))
+        return {
+            "provider_domain": domain,
+            "urls": data["urls"],
+            "product_count": len(merged_products),
+            "dedupe": dedupe_stats,
+            "products": merged_products,
+            "categories": self._extract_categories(merged_products),
+            "price_range": self._calculate_price_range(merged_products),
+            "unique_features": self._extract_unique_features(merged_products),
+            "is_british_gas": ("britishgas.co.uk" in domain),
+        }
+    
     def _extract_categories(self, products: List[Dict[str, Any]]) -> List[str]:
-        """Extract unique product categories."""
-        categories = set()
-        for product in products:
-            if product.get("category"):
-                categories.add(product["category"])
-        return list(categories)
+        """Extract unique product categories in first-seen order (keeps prompts stable for caching)."""
+        return list(dict.fromkeys(p["category"] for p in products if p.get("category")))
     
     def _calculate_price_range(self, products: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Calculate price ranges from products."""
-        import re
-        
-        monthly_prices = []
-        annual_prices = []
-        
-        for product in products:
-            # Extract numeric value from price strings
-            if product.get("price_monthly"):
-                match = re.search(r'[\d.]+', str(product["price_monthly"]))
-                if match:
-                    monthly_prices.append(float(match.group()))
-            
-            if product.get("price_annual"):
-                match = re.search(r'[\d.]+', str(product["price_annual"]))
-                if match:
-                    annual_prices.append(float(match.group()))
+        monthly_prices = self._extract_prices(products, "price_monthly")
+        annual_prices = self._extract_prices(products, "price_annual")
         
         return {
-            "monthly": {
-                "min": min(monthly_prices) if monthly_prices else None,
-                "max": max(monthly_prices) if monthly_prices else None,
-                "avg": sum(monthly_prices) / len(monthly_prices) if monthly_prices else None,
-            },
-            "annual": {
-                "min": min(annual_prices) if annual_prices else None,
-                "max": max(annual_prices) if annual_prices else None,
-                "avg": sum(annual_prices) / len(annual_prices) if annual_prices else None,
-            }
+            "monthly": self._price_stats(monthly_prices),
+            "annual": self._price_stats(annual_prices),
+        }
+
+    @staticmethod
+    def _extract_prices(products: List[Dict[str, Any]], field: str) -> np.ndarray:
+        """Extract the first numeric value from each product's price string."""
+        return np.fromiter(
+            (
+                float(m.group())
+                for p in products
+                if (v := p.get(field)) and (m := PRICE_RE.search(str(v)))
+            ),
+            dtype=np.float64,
+        )
+
+    @staticmethod
+    def _price_stats(prices: np.ndarray) -> Dict[str, Any]:
+        if prices.size == 0:
+            return {"min": None, "max": None, "avg": None}
+        return {
+            "min": float(prices.min()),
+            "max": float(prices.max()),
+            "avg": float(prices.mean()),
         }
     
     def _extract_unique_features(self, products: List[Dict[str, Any]]) -> Dict[str, int]:
         """Extract and count unique features across products."""
-        feature_count = {}
+        feature_count: Counter = Counter()
         
         for product in products:
-            if product.get("features") and isinstance(product["features"], list):
-                for feature in product["features"]:
-                    if isinstance(feature, str):
-                        # Normalize feature string
-                        normalized = feature.strip().lower()
-                        feature_count[normalized] = feature_count.get(normalized, 0) + 1
+            features = product.get("features")
+            if features and isinstance(features, list):
+                # Normalize feature strings
+                feature_count.update(f.strip().lower() for f in features if isinstance(f, str))
         
         # Sort by frequency
-        return dict(sorted(feature_count.items(), key=lambda x: x[1], reverse=True))
+        return dict(feature_count.most_common())
     
+    def _format_analysis_data(self, analysis_data: Dict[str, Any]) -> str:
+        """
+        Serialize analysis data for the report prompt.
+        Aggregated stats stay JSON; products become a column-oriented table so
+        field names are written once instead of once per product.
+        """
+        summary = {
+            domain: {k: v for k, v in data.items() if k != "products"}
+            for domain, data in analysis_data.items()
+        }
+        rows = ["\t".join(("provider",) + _PRODUCT_TABLE_FIELDS)]
+        for domain, data in analysis_data.items():
+            for product in data.get("products", []):
+                rows.append("\t".join([domain] + [_table_cell(product.get(f)) for f in _PRODUCT_TABLE_FIELDS]))
+
+        return (
+            f"Provider summary (JSON):\n{_dumps(summary)}\n\n"
+            f"Products (tab-separated, one row per product; features separated by '; '):\n"
+            + "\n".join(rows)
+        )
+
     def _create_analysis_prompt(self, analysis_data: Dict[str, Any]) -> str:
         """Create the prompt for competitive analysis."""
         
-        # Format data as JSON for clarity
-        data_json = json.dumps(analysis_data, indent=2, default=str)
+        # Compact layout: per-provider stats as JSON, products as one tab-separated table
+        data_json = self._format_analysis_data(analysis_data)
 
         # Baseline provider for comparison
         has_bg = any(v.get("is_british_gas") for v in analysis_data.values()) if analysis_data else False
@@ -190,17 +319,50 @@ Format the response with clear headings, bullet points where appropriate, and sp
         
         return prompt
     
-    def generate_summary_report(self, products_by_url: Dict[str, List[Dict[str, Any]]]) -> str:
+    def generate_summary_report(self, products_by_url: Dict[str, List[Dict[str, Any]]], use_cache: bool = True) -> str:
         """
         Generate a shorter summary report for quick insights.
         """
-        try:
-            # Prepare data
-            analysis_data = self._prepare_data_for_analysis(products_by_url)
-            data_json = json.dumps(analysis_data, indent=2, default=str)
-            has_bg = any(v.get("is_british_gas") for v in analysis_data.values()) if analysis_data else False
-            
-            prompt = f"""Provide a concise comparison summary where British Gas is the baseline (if present).
+        return "".join(self.stream_summary_report(products_by_url, use_cache=use_cache))
+
+    def stream_summary_report(self, products_by_url: Dict[str, List[Dict[str, Any]]], use_cache: bool = True) -> Iterator[str]:
+        """
+        Stream the summary report as it is generated.
+        With use_cache=False a fresh summary is generated even if one is cached for the same data.
+        """
+        # Prepare data
+        analysis_data = self._prepare_data_for_analysis(products_by_url)
+        prompt = self._create_summary_prompt(analysis_data)
+
+        yield from self._stream_completion(
+            prompt,
+            max_tokens=1500,
+            label="summary report",
+            error_message="Error generating summary report.",
+            use_cache=use_cache,
+        )
+
+    def _create_summary_prompt(self, analysis_data: Dict[str, Any]) -> str:
+        """Create the prompt for the executive summary."""
+        # The summary is brief, so send a digest per provider rather than every product
+        compact = {
+            domain: {
+                "product_count": data["product_count"],
+                "categories": data["categories"],
+                "price_range": data["price_range"],
+                "top_features": dict(islice(data["unique_features"].items(), 10)),
+                "top_products": [
+                    {f: p.get(f) for f in _PRODUCT_TABLE_FIELDS}
+                    for p in sorted(data["products"], key=lambda p: -len(p.get("features") or []))[:3]
+                ],
+                "is_british_gas": data["is_british_gas"],
+            }
+            for domain, data in analysis_data.items()
+        }
+        data_json = _dumps(compact)
+        has_bg = any(v.get("is_british_gas") for v in analysis_data.values()) if analysis_data else False
+        
+        return f"""Provide a concise comparison summary where British Gas is the baseline (if present).
 If British Gas is missing, state that and provide a general summary.
 British Gas present in dataset: {has_bg}
 
@@ -213,17 +375,3 @@ Include:
 4. One primary recommendation (actionable)
 
 Keep it brief and actionable."""
-            
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=1500,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            return message.content[0].text
-        
-        except anthropic.APIError as e:
-            logger.error(f"Error generating summary report: {e}")
-            return "Error generating summary report."
\ No newline at end of file
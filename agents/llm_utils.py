@@ -1,12 +1,256 @@
+import ast
+import asyncio
+import functools
+import html
 import json
 import logging
+import random
 import time
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Tuple
 import anthropic
+import numpy as np
 import re
 
+from config import ANTHROPIC_MODEL, LATENCY_OPTIMIZED_INFERENCE
+from utils.cache import TTLCache
+from utils.rate_limit import TokenRateLimiter
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is the fallback
+    orjson = None
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:  # optional; a regex-based tag strip is the fallback
+    HTMLParser = None
+
+try:
+    from json_repair import repair_json
+except ImportError:  # optional; the bracket-matching fallbacks still apply without it
+    repair_json = None
+
 logger = logging.getLogger(__name__)
 
+# Currency amounts and common pricing tokens, fused into one alternation so
+# _build_extraction_input scans the HTML once instead of once per pattern.
+_PRICING_TOKEN_RE = re.compile(
+    r"[£$€]\s*\d"                            # currency symbol + digit
+    r"|\b(?:per\s+month|a\s+month|monthly"    # pricing phrasing
+    r"|annually|year"
+    r"|excess|deductible"
+    r"|cover|plan|premium|options)\b",
+    re.IGNORECASE,
+)
+
+# Prices or product words; any single hit is enough to justify a retry
+_PRODUCT_INDICATOR_RE = re.compile(r"[£$€]\s*\d|\b(?:product|plan|cover|premium|option)", re.IGNORECASE)
+
+# Fallback markup stripping when selectolax isn't installed
+_JSON_LD_RE = re.compile(
+    r'<script[^>]*type=["\']application/ld\+json["\'][^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL,
+)
+_TITLE_RE = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+_INVISIBLE_BLOCK_RE = re.compile(
+    r"<(script|style|svg|noscript|template|head)\b.*?</\1\s*>",
+    re.IGNORECASE | re.DOTALL,
+)
+_TAG_RE = re.compile(r"<[^>]+>")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# JSON repair passes
+_TRAILING_COMMA_BRACKET_RE = re.compile(r",\s*]")
+_TRAILING_COMMA_BRACE_RE = re.compile(r",\s*}")
+_DOUBLE_QUOTED_RE = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_SINGLE_QUOTED_RE = re.compile(r"'(?:[^'\\]|\\.)*'", re.DOTALL)
+# Braces and string literals, for finding product objects in free text
+_OBJECT_TOKEN_RE = re.compile(r'"product_name"|"(?:[^"\\]|\\.)*"|[{}]', re.DOTALL)
+# Markers of a Python literal rather than JSON (worth an ast.literal_eval attempt)
+_PYTHON_LITERAL_HINT_RE = re.compile(r"'|\b(?:None|True|False)\b")
+# Characters that change state while matching JSON array brackets
+_ARRAY_DELIMITER_RE = re.compile(r"[\[\]\"'\\]")
+# str.translate tables: drop control characters except tab/newline/CR; flatten newlines to spaces
+_CTRL_CHARS_TABLE = str.maketrans("", "", "".join(chr(c) for c in range(32) if c not in (9, 10, 13)))
+_NEWLINES_TO_SPACE_TABLE = {10: " ", 13: " "}
+
+# Parsed extraction results keyed by model + URL + page content
+_EXTRACT_CACHE = TTLCache()
+
+# Shared by every extraction call in the process so concurrent scrapes pace against one budget
+_RATE_LIMITER = TokenRateLimiter()
+
+
+# Bound every request: fail fast on connect, and cap the wait between streamed chunks.
+# SDK-level retries are kept to one quick retry; _create_with_retry owns the longer backoff.
+_CLIENT_OPTIONS: Dict[str, Any] = {
+    "timeout": anthropic.Timeout(60.0, connect=5.0),
+    "max_retries": 1,
+}
+
+
+@functools.lru_cache(maxsize=4)
+def get_client(api_key: str) -> anthropic.Anthropic:
+    """One client per API key so the underlying HTTP connection pool is reused across calls."""
+    return anthropic.Anthropic(api_key=api_key, **_CLIENT_OPTIONS)
+
+
+def new_async_client(api_key: str) -> anthropic.AsyncAnthropic:
+    """Async client with the same bounds as `get_client`; use as an async context manager."""
+    return anthropic.AsyncAnthropic(api_key=api_key, **_CLIENT_OPTIONS)
+
+
+def inference_options() -> Dict[str, Any]:
+    """Extra keyword arguments applied to every Claude request."""
+    if LATENCY_OPTIMIZED_INFERENCE:
+        return {"extra_body": {"performanceConfig": {"latency": "optimized"}}}
+    return {}
+
+
+def _stream_message(client: anthropic.Anthropic, stop_after_array: bool = False, **kwargs):
+    """
+    Send a request over the streaming API and return the final message.
+    Tokens are consumed as they are generated instead of waiting on one large
+    response body, which also avoids the SDK's timeout for long non-streaming calls.
+
+    With stop_after_array, the stream is closed as soon as the reply is a complete
+    JSON array, so trailing prose or fences aren't waited on (or billed), and the
+    message received so far is returned.
+    """
+    with client.messages.stream(**kwargs, **inference_options()) as stream:
+        if stop_after_array:
+            scanner = _ArrayCloseScanner()
+            for text in stream.text_stream:
+                if scanner.feed(text):
+                    return stream.current_message_snapshot
+        return stream.get_final_message()
+
+
+async def _stream_message_async(client: anthropic.AsyncAnthropic, stop_after_array: bool = False, **kwargs):
+    """Async counterpart of `_stream_message`."""
+    async with client.messages.stream(**kwargs, **inference_options()) as stream:
+        if stop_after_array:
+            scanner = _ArrayCloseScanner()
+            async for text in stream.text_stream:
+                if scanner.feed(text):
+                    return stream.current_message_snapshot
+        return await stream.get_final_message()
+
+
+class _ArrayCloseScanner:
+    """
+    Incremental check for a streamed reply that is a closed top-level JSON array,
+    optionally after an opening code fence. Each chunk is scanned once, carrying
+    bracket depth and string state across chunks, so the check stays linear in the
+    length of the reply.
+    """
+
+    _FENCES = ("", "```", "```json")
+
+    def __init__(self):
+        self._prefix = ""  # text before the opening "[" (only kept until it is found)
+        self._depth = 0  # 0 until the opening "[" is seen
+        self._quote: Optional[str] = None
+        self._escaped = False  # a backslash ended the previous chunk inside a string
+        self._failed = False
+
+    def feed(self, text: str) -> bool:
+        """Consume the next chunk; True once the array has closed."""
+        if self._failed:
+            return False
+        pos = 0
+        if not self._depth:
+            start = text.find("[")
+            if start == -1:
+                self._prefix += text
+                # Anything other than a (partial) code fence before the array rules it out for good
+                if not "```json".startswith(self._prefix.strip()):
+                    self._failed = True
+                return False
+            if (self._prefix + text[:start]).strip() not in self._FENCES:
+                self._failed = True
+                return False
+            self._depth = 1
+            pos = start + 1
+        # Only brackets, quotes and backslashes change state, so jump between them
+        skip = pos if self._escaped else -1
+        self._escaped = False
+        for m in _ARRAY_DELIMITER_RE.finditer(text, pos):
+            i = m.start()
+            if i == skip:
+                continue
+            c = m.group()
+            if self._quote:
+                if c == "\\":
+                    skip = i + 1
+                elif c == self._quote:
+                    self._quote = None
+            elif c == "[":
+                self._depth += 1
+            elif c == "]":
+                self._depth -= 1
+                if not self._depth:
+                    return True
+            elif c in "\"'":
+                self._quote = c
+        self._escaped = skip == len(text)
+        return False
+
+
+def _visible_text(html_content: str) -> str:
+    """
+    Reduce an HTML page to its title, JSON-LD blocks and visible text.
+    Inline CSS, scripts and SVGs make up most of a typical page and carry no pricing,
+    so dropping them shrinks both the regex scan and the tokens sent to Claude.
+    Non-HTML input (e.g. embedded __NEXT_DATA__ JSON) is returned unchanged.
+    """
+    if html_content.find("<", 0, 2000) == -1:
+        return html_content
+
+    if HTMLParser is not None:
+        tree = HTMLParser(html_content)
+        title = tree.css_first("title")
+        keep = [html.unescape(title.text(strip=True))] if title is not None else []
+        keep.extend(node.text() for node in tree.css('script[type="application/ld+json"]'))
+        tree.strip_tags(["script", "style", "svg", "noscript", "template"])
+        root = tree.body or tree.root
+        keep.append(root.text(separator=" ", strip=True) if root is not None else "")
+    else:
+        title = _TITLE_RE.search(html_content)
+        keep = [html.unescape(title.group(1).strip())] if title else []
+        keep.extend(_JSON_LD_RE.findall(html_content))
+        text = _TAG_RE.sub(" ", _INVISIBLE_BLOCK_RE.sub(" ", html_content))
+        keep.append(_WHITESPACE_RE.sub(" ", html.unescape(text)).strip())
+
+    return "\n".join(part for part in keep if part)
+
+
+def _iter_window_bounds(html_content: str, budget: int, pre: int = 1200, post: int = 2400) -> Iterator[int]:
+    """
+    Yield start, end pairs (flattened) for the prefix window and a window around each
+    currency amount / pricing token, in document order.
+    Stops scanning once the windows cover `budget` distinct chars; the caller truncates
+    to less than that, so the rest of a long page would never reach the output.
+    """
+    n = len(html_content)
+    # Always include a small prefix for context (title, H1, etc.)
+    prefix_len = min(8000, n)
+    yield 0
+    yield prefix_len
+
+    covered = last_end = prefix_len
+    for m in _PRICING_TOKEN_RE.finditer(html_content):
+        start = max(0, m.start() - pre)
+        end = min(n, m.end() + post)
+        yield start
+        yield end
+        if end > last_end:
+            covered += end - max(start, last_end)
+            last_end = end
+            if covered >= budget:
+                return
+
+
 def _build_extraction_input(html_content: str, max_chars: int = 60000) -> str:
     """
     Build a compact but information-dense HTML/text input for the LLM.
@@ -17,45 +261,23 @@ def _build_extraction_input(html_content: str, max_chars: int = 60000) -> str:
     - Add windows around currency occurrences (e.g. £15.50, $99)
     - Add windows around common product/plan words
     - De-dupe and merge overlapping windows
+    - Stop scanning once the windows already exceed what max_chars can hold
     """
     if not html_content:
         return ""
 
-    # Always include a small prefix for context (title, H1, etc.)
-    prefix_len = min(8000, len(html_content))
-    windows: List[tuple[int, int]] = [(0, prefix_len)]
-
-    # Capture windows around currency amounts and common pricing tokens.
-    patterns = [
-        r"[£$€]\s*\d",                   # currency symbol + digit
-        r"\b(per\s+month|a\s+month)\b",  # pricing phrasing
-        r"\bmonthly\b",
-        r"\bannually\b|\byear\b",
-        r"\bexcess\b|\bdeductible\b",
-        r"\bcover\b|\bplan\b|\bpremium\b|\boptions\b",
-    ]
-
-    # Use fairly small windows to keep total size bounded.
-    pre = 1200
-    post = 2400
-
-    for pat in patterns:
-        try:
-            for m in re.finditer(pat, html_content, flags=re.IGNORECASE):
-                start = max(0, m.start() - pre)
-                end = min(len(html_content), m.end() + post)
-                windows.append((start, end))
-        except re.error:
-            continue
+    html_content = _visible_text(html_content)
 
-    # Sort and merge overlaps
-    windows.sort(key=lambda x: x[0])
-    merged: List[tuple[int, int]] = []
-    for s, e in windows:
-        if not merged or s > merged[-1][1]:
-            merged.append((s, e))
-        else:
-            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+    # Flat (start, end, start, end, ...) stream so NumPy fills one buffer without per-tuple conversion.
+    bounds = np.fromiter(_iter_window_bounds(html_content, budget=max_chars * 3 // 2), dtype=np.int64)
+    starts, ends = bounds[0::2], bounds[1::2]
+
+    # Merge overlaps: a window opens a new run when it starts past every earlier end.
+    # finditer yields matches left to right and the prefix starts at 0, so starts are already sorted.
+    run_ends = np.maximum.accumulate(ends)
+    opens = np.flatnonzero(np.r_[True, starts[1:] > run_ends[:-1]])
+    closes = np.r_[opens[1:] - 1, len(starts) - 1]
+    merged = zip(starts[opens].tolist(), run_ends[closes].tolist())
 
     # Concatenate merged windows until max_chars is reached
     parts: List[str] = []
@@ -80,319 +302,482 @@ def _extract_product_objects_from_text(text: str) -> list:
     Find and parse JSON objects that contain "product_name" (e.g. when the model returns
     malformed array or extra text). Returns list of product dicts or empty list.
     """
-    out = []
-    i = 0
-    n = len(text)
-    while i < n:
-        # Look for start of object that looks like product
-        idx = text.find('"product_name"', i)
-        if idx == -1:
-            break
-        # Find preceding opening brace
-        start = text.rfind("{", i, idx + 1)
-        if start == -1:
-            i = idx + 1
+    # One forward pass over braces and string literals. Each open brace is a stack frame
+    # flagged once a "product_name" key appears directly inside it; flagged objects are
+    # parsed when they close. Braces inside strings are skipped with the string token.
+    found: List[Tuple[int, dict]] = []
+    stack: List[List[Any]] = []  # [start index, saw product_name]
+    for m in _OBJECT_TOKEN_RE.finditer(text):
+        token = m.group()
+        if token == "{":
+            stack.append([m.start(), False])
+        elif token == "}":
+            if not stack:
+                continue
+            start, saw_name = stack.pop()
+            if not saw_name:
+                continue
+            candidate = text[start : m.end()]
+            try:
+                repaired = _TRAILING_COMMA_BRACKET_RE.sub("]", _TRAILING_COMMA_BRACE_RE.sub("}", candidate))
+                repaired = _strip_control_chars(repaired)
+                obj = _json_loads(repaired)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(obj, dict) and obj.get("product_name") is not None:
+                # An enclosing product replaces any product objects nested inside it
+                while found and found[-1][0] > start:
+                    found.pop()
+                found.append((start, obj))
+        elif token == '"product_name"' and stack:
+            stack[-1][1] = True
+    return [obj for _, obj in found]
+
+
+def _strip_control_chars(s: str) -> str:
+    """Drop control characters JSON rejects, keeping tab/newline/CR (one C-level pass)."""
+    return s.translate(_CTRL_CHARS_TABLE)
+
+
+def _fix_newlines_in_quotes(m: "re.Match[str]") -> str:
+    return m.group(0).translate(_NEWLINES_TO_SPACE_TABLE)
+
+
+def _repair_json(s: str) -> str:
+    """Apply common repairs to malformed JSON."""
+    s = s.strip()
+    # Remove trailing commas before ] or }
+    s = _TRAILING_COMMA_BRACKET_RE.sub("]", s)
+    s = _TRAILING_COMMA_BRACE_RE.sub("}", s)
+    # Replace literal newlines inside quoted strings with spaces (nothing to do for single-line output)
+    if "\n" in s or "\r" in s:
+        s = _DOUBLE_QUOTED_RE.sub(_fix_newlines_in_quotes, s)
+        if "'" in s:
+            s = _SINGLE_QUOTED_RE.sub(_fix_newlines_in_quotes, s)
+    # Strip control characters
+    return _strip_control_chars(s)
+
+
+def _json_loads(s: str) -> Any:
+    """
+    Parse JSON with orjson when installed, falling back to the stdlib parser for input
+    orjson is stricter about (NaN/Infinity, integers beyond 64 bits).
+    Failures raise json.JSONDecodeError either way (orjson's error subclasses it).
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(s)
+
+
+def _as_product_list(value: Any) -> Optional[list]:
+    """A parsed array as-is, a single object as a one-item list, anything else as None."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        return [value]
+    return None
+
+
+def _try_parse_json(s: str):
+    """Try to parse JSON string, return None if fails."""
+    s = s.strip()
+    if not s:
+        return None
+    try:
+        return _as_product_list(_json_loads(s))
+    except json.JSONDecodeError:
+        pass
+    # Only pay for the repair passes when the raw text doesn't parse
+    try:
+        return _as_product_list(_json_loads(_repair_json(s)))
+    except json.JSONDecodeError:
+        pass
+    # literal_eval only rescues Python-style literals (single quotes, None/True/False) that
+    # start as a list or dict; skip building an AST for anything else.
+    if s[0] not in "[{" or not _PYTHON_LITERAL_HINT_RE.search(s):
+        return None
+    try:
+        return _as_product_list(ast.literal_eval(s))
+    except Exception:
+        return None
+
+
+def _repair_products(text: str) -> Optional[list]:
+    """
+    Last-resort tolerant parse with json_repair (unquoted keys, unterminated strings,
+    truncated arrays). It turns almost any text into *something*, so its output is only
+    trusted when it is a non-empty list of product dicts.
+    """
+    if repair_json is None or not text.strip():
+        return None
+    try:
+        out = _as_product_list(repair_json(text, return_objects=True))
+    except Exception:
+        return None
+    if out and all(isinstance(p, dict) for p in out):
+        return out
+    return None
+
+
+def _find_array_bounds(text: str) -> tuple:
+    """Find start/end of top-level JSON array, respecting strings. Returns (start, end) or (-1, -1)."""
+    # Only brackets, quotes and backslashes change state, so jump between them instead of
+    # stepping through every character. `skip` is the position consumed by a backslash escape.
+    # First pass: find candidate "[" that are not inside a string
+    candidates = []
+    quote = None
+    skip = -1
+    for m in _ARRAY_DELIMITER_RE.finditer(text):
+        i = m.start()
+        if i == skip:
             continue
-        # Find matching closing brace
-        depth = 0
-        end = -1
-        for j in range(start, n):
-            if text[j] == "{":
+        c = m.group()
+        if quote:
+            if c == "\\":
+                skip = i + 1
+            elif c == quote:
+                quote = None
+        elif c == "[":
+            candidates.append(i)
+        elif c in "\"'":
+            quote = c
+    # For first candidate, run string-aware bracket match
+    for start in candidates:
+        depth = 1
+        quote = None
+        skip = -1
+        for m in _ARRAY_DELIMITER_RE.finditer(text, start + 1):
+            i = m.start()
+            if i == skip:
+                continue
+            c = m.group()
+            if quote:
+                if c == "\\":
+                    skip = i + 1
+                elif c == quote:
+                    quote = None
+            elif c == "[":
                 depth += 1
-            elif text[j] == "}":
+            elif c == "]":
                 depth -= 1
                 if depth == 0:
-                    end = j
-                    break
-        if end == -1:
-            i = start + 1
-            continue
-        candidate = text[start : end + 1]
-        i = end + 1
-        try:
-            repaired = re.sub(r",\s*]", "]", re.sub(r",\s*}", "}", candidate))
-            repaired = "".join(c for c in repaired if ord(c) >= 32 or c in "\n\r\t")
-            obj = json.loads(repaired)
-            if isinstance(obj, dict) and obj.get("product_name") is not None:
-                out.append(obj)
-        except json.JSONDecodeError:
-            continue
-    return out
+                    return (start, i)
+            elif c in "\"'":
+                quote = c
+    return (-1, -1)
 
 
-def extract_product_data(html_content: str, url: str, api_key: str, max_retries: int = 3) -> list:
+def _parse_products_response(response_text: str) -> Optional[list]:
     """
-    Use Claude to intelligently extract product data from HTML.
-    Returns list of product dictionaries with extracted information.
-    
-    Args:
-        html_content: HTML content to analyze
-        url: Source URL for logging
-        api_key: Anthropic API key
-        max_retries: Maximum number of retries for rate limit errors
+    Run the parsing strategies over a model response in order of cost.
+    Returns the parsed product list, or None if nothing could be parsed.
     """
-    client = anthropic.Anthropic(api_key=api_key)
-    
-    # Smart extraction: includes prefix + windows around every £/$ and pricing phrase (not "first N chars").
-    # Use 60k to ensure all price blocks are captured. Rate limiting handled by delays between requests.
-    html_for_analysis = _build_extraction_input(html_content, max_chars=120000)
-    
-    prompt = f"""You are a data extraction expert. Analyze the following HTML content from {url} and extract ALL product/service offerings.
+    products = None
 
-CRITICAL: Your response must be ONLY a valid JSON array. No text before or after. No markdown code fences. No explanation. Use double quotes for keys and strings. Escape any quotes inside strings with backslash. Use null for missing values.
+    # Strategy 1: Direct parse
+    logger.debug(f"Strategy 1: Trying direct parse of response (length: {len(response_text)})")
+    products = _try_parse_json(response_text)
+    if products:
+        logger.debug(f"Strategy 1 SUCCESS: Found {len(products)} products")
+    else:
+        logger.debug("Strategy 1 FAILED: Direct parse returned None")
 
-IMPORTANT: Look carefully for product names, prices (look for £, $, currency symbols), plan names, coverage options. Extract even partial information if full details aren't available. Only return empty array [] if you are absolutely certain there are NO products/services mentioned anywhere in the HTML.
+    # Strategy 2: Markdown code blocks
+    if products is None:
+        logger.debug("Strategy 2: Trying markdown code block extraction")
+        # If the first fence is the ```json one, the plain ``` marker would re-parse the same block
+        same_fence = response_text.find("```") == response_text.find("```json")
+        for marker in (["```json"] if same_fence else ["```json", "```"]):
+            if marker in response_text:
+                logger.debug(f"Found markdown marker: {marker}")
+                try:
+                    parts = response_text.split(marker, 1)
+                    if len(parts) > 1:
+                        code_block = parts[1].split("```", 1)[0].strip()
+                        # Remove "json" prefix if present (from ```json marker)
+                        if code_block.startswith("json"):
+                            code_block = code_block[4:].strip()
+                        logger.debug(f"Extracted code block (length: {len(code_block)}, first 200: {code_block[:200]})")
+                        products = _try_parse_json(code_block)
+                        if products is not None:
+                            logger.debug(f"Strategy 2 SUCCESS with {marker}: Found {len(products)} products")
+                            break
+                        else:
+                            logger.debug(f"Strategy 2 FAILED with {marker}: _try_parse_json returned None, trying repair")
+                            # Try with repair
+                            repaired = _repair_json(code_block)
+                            products = _try_parse_json(repaired)
+                            if products is not None:
+                                logger.debug(f"Strategy 2 SUCCESS with {marker} (after repair): Found {len(products)} products")
+                                break
+                            else:
+                                logger.debug(f"Strategy 2 FAILED with {marker} (even after repair)")
+                except Exception as e:
+                    logger.debug(f"Strategy 2 exception with {marker}: {e}")
+                    continue
 
-Required fields per product (use null if not found):
-- product_name (string) - REQUIRED, extract this even if other fields are missing
-- price_monthly (string with currency e.g. "£15.50" or null)
-- price_annual (string with currency or null)
-- excess (string or null)
-- features (array of strings)
-- special_offers (string or null)
-- terms_conditions (string or null)
-- category (string)
+    # Strategy 3: String-aware bracket matching for [...] (repair included, so no separate repair-only pass)
+    if products is None and "[" in response_text:
+        logger.debug("Strategy 3: Trying string-aware bracket matching")
+        start, end = _find_array_bounds(response_text)
+        if start != -1 and end > start:
+            json_candidate = response_text[start : end + 1]
+            logger.debug(f"Found array bounds: start={start}, end={end}, length={len(json_candidate)}")
+            products = _try_parse_json(json_candidate)
+            if products:
+                logger.debug(f"Strategy 3 SUCCESS: Found {len(products)} products")
+            else:
+                logger.debug("Strategy 3 FAILED: _try_parse_json returned None, trying repair")
+                repaired = _repair_json(json_candidate)
+                products = _try_parse_json(repaired)
+                if products:
+                    logger.debug(f"Strategy 3 SUCCESS (after repair): Found {len(products)} products")
+                else:
+                    logger.debug("Strategy 3 FAILED: Even after repair")
+        else:
+            logger.debug(f"Strategy 3 FAILED: No array bounds found (start={start}, end={end})")
 
-Example valid response (no other text):
-[{{"product_name": "Plan A", "price_monthly": "£10", "price_annual": "£120", "excess": "£50", "features": ["Cover 1"], "special_offers": null, "terms_conditions": null, "category": "Boiler"}}]
+    # Strategy 4: Extract product-like JSON objects and merge into list (handles truncated/malformed array)
+    if products is None and '"product_name"' in response_text:
+        logger.debug("Strategy 4: Trying object extraction")
+        _extracted = _extract_product_objects_from_text(response_text)
+        if _extracted:
+            logger.debug(f"Strategy 4 SUCCESS: Found {len(_extracted)} products")
+            products = _extracted
+        else:
+            logger.debug("Strategy 4 FAILED: No objects extracted")
+
+    # Strategy 5: json_repair over the whole reply (malformed or truncated JSON the scans can't rescue)
+    if products is None:
+        logger.debug("Strategy 5: Trying json_repair")
+        products = _repair_products(response_text)
+        if products:
+            logger.debug(f"Strategy 5 SUCCESS: Found {len(products)} products")
+        else:
+            logger.debug("Strategy 5 FAILED: No list of product objects recovered")
+
+    return products
+
+
+def _is_rate_limit_error(e: anthropic.APIError) -> bool:
+    """Check if an API error is a rate limit error (429)."""
+    return (
+        hasattr(e, 'status_code') and e.status_code == 429
+    ) or (
+        hasattr(e, 'response') and hasattr(e.response, 'status_code') and e.response.status_code == 429
+    ) or (
+        "rate_limit" in str(e).lower() or "429" in str(e)
+    )
+
+
+def _is_retryable_error(e: anthropic.APIError) -> bool:
+    """Rate limits, overload (529), other 5xx and dropped connections are transient; request errors are not."""
+    if _is_rate_limit_error(e) or isinstance(e, anthropic.APIConnectionError):
+        return True
+    status_code = getattr(e, "status_code", None)
+    return isinstance(status_code, int) and status_code >= 500
+
+
+def _retry_wait_seconds(e: anthropic.APIError, attempt: int) -> float:
+    """
+    Seconds to wait before retrying a rate-limited or overloaded call.
+    Honours the server's Retry-After header; otherwise exponential backoff with jitter
+    so concurrent scrapers hitting the same per-minute token window don't retry in lockstep.
+    """
+    response = getattr(e, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+    return min(60, 8 * 2 ** attempt) * random.uniform(0.5, 1.5)
 
-HTML Content:
-{html_for_analysis}
-"""
 
-    # Retry logic for rate limit errors
+def _estimate_tokens(prompt: str) -> int:
+    """Rough input size (~4 chars per token) reserved with the rate limiter before a call."""
+    return len(prompt) // 4
+
+
+def _used_tokens(message) -> int:
+    """Input + output tokens reported for a completed (or early-closed) message."""
+    usage = getattr(message, "usage", None)
+    if usage is None:
+        return 0
+    return (usage.input_tokens or 0) + (usage.output_tokens or 0)
+
+
+def _create_with_retry(client: anthropic.Anthropic, prompt: str, url: str, max_tokens: int = 2000, max_retries: int = 5, expect_array: bool = True):
+    """
+    Call Claude, backing off on rate limits, overload and other transient errors.
+    expect_array stops reading once the reply is a complete JSON array (see `_stream_message`).
+    Returns the message, or None if the call failed after all retries.
+    """
+    waited = 0.0
     for attempt in range(max_retries):
+        reservation_estimate = _estimate_tokens(prompt)
+        reservation = _RATE_LIMITER.acquire(reservation_estimate)
         try:
-            message = client.messages.create(
-                model="claude-sonnet-4-5-20250929",
-                max_tokens=2000,
+            message = _stream_message(
+                client,
+                stop_after_array=expect_array,
+                model=ANTHROPIC_MODEL,
+                max_tokens=max_tokens,
                 messages=[
                     {"role": "user", "content": prompt}
-                ]
+                ],
             )
-            break  # Success, exit retry loop
+            used = _used_tokens(message)
+            _RATE_LIMITER.reconcile(reservation, used)
+            logger.debug(f"Claude usage for {url}: {used} tokens (estimated {reservation_estimate})")
+            return message
         except anthropic.APIError as e:
-            # Check if it's a rate limit error (429)
-            is_rate_limit = (
-                hasattr(e, 'status_code') and e.status_code == 429
-            ) or (
-                hasattr(e, 'response') and hasattr(e.response, 'status_code') and e.response.status_code == 429
-            ) or (
-                "rate_limit" in str(e).lower() or "429" in str(e)
-            )
+            retryable = _is_retryable_error(e)
             
-            if is_rate_limit and attempt < max_retries - 1:
-                # Longer backoff so rate limit window can reset (30k tokens/min)
-                wait_time = (8, 25, 60)[min(attempt, 2)]
+            if retryable and attempt < max_retries - 1:
+                wait_time = _retry_wait_seconds(e, attempt)
+                waited += wait_time
                 logger.warning(
-                    f"Rate limit hit for {url} (attempt {attempt + 1}/{max_retries}). "
-                    f"Waiting {wait_time}s before retry..."
+                    f"{type(e).__name__} for {url} (attempt {attempt + 1}/{max_retries}). "
+                    f"Waiting {wait_time:.1f}s before retry ({waited:.1f}s total)..."
                 )
                 time.sleep(wait_time)
             else:
                 # Last attempt failed or non-rate-limit error
-                if is_rate_limit:
-                    logger.error(f"Rate limit error for {url} after {max_retries} attempts: {e}")
+                if retryable:
+                    logger.error(f"{type(e).__name__} for {url} after {max_retries} attempts: {e}")
                 else:
                     logger.error(f"API error while extracting data from {url}: {e}")
-                return []
+                return None
+    return None
 
-    try:
-        
-        response_text = message.content[0].text or ""
 
-        def _repair_json(s: str) -> str:
-            """Apply common repairs to malformed JSON."""
-            s = s.strip()
-            # Remove trailing commas before ] or }
-            s = re.sub(r",\s*]", "]", s)
-            s = re.sub(r",\s*}", "}", s)
-            # Replace unescaped newlines inside double-quoted strings (simplified: replace \n not preceded by \)
-            # Match "...." and replace literal newlines with \n
-            def fix_newlines_in_quotes(m):
-                return m.group(0).replace("\n", " ").replace("\r", " ")
-            s = re.sub(r'"(?:[^"\\]|\\.)*"', fix_newlines_in_quotes, s, flags=re.DOTALL)
-            s = re.sub(r"'(?:[^'\\]|\\.)*'", fix_newlines_in_quotes, s, flags=re.DOTALL)
-            # Strip control characters
-            s = "".join(c for c in s if ord(c) >= 32 or c in "\n\r\t")
-            return s
-
-        def _try_parse_json(s: str):
-            """Try to parse JSON string, return None if fails."""
-            s = s.strip()
-            if not s:
-                return None
-            for candidate in (s, _repair_json(s)):
-                try:
-                    out = json.loads(candidate)
-                    if isinstance(out, list):
-                        return out
-                    if isinstance(out, dict):
-                        return [out]
-                    return None
-                except json.JSONDecodeError:
-                    continue
-            try:
-                import ast
-                value = ast.literal_eval(s)
-                if isinstance(value, list):
-                    return value
-                if isinstance(value, dict):
-                    return [value]
-                return None
-            except Exception:
+async def _create_with_retry_async(client: anthropic.AsyncAnthropic, prompt: str, url: str, max_tokens: int = 2000, max_retries: int = 5, expect_array: bool = True):
+    """Async counterpart of `_create_with_retry`; sleeps without blocking other requests."""
+    waited = 0.0
+    for attempt in range(max_retries):
+        reservation_estimate = _estimate_tokens(prompt)
+        reservation = await _RATE_LIMITER.acquire_async(reservation_estimate)
+        try:
+            message = await _stream_message_async(
+                client,
+                stop_after_array=expect_array,
+                model=ANTHROPIC_MODEL,
+                max_tokens=max_tokens,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+            )
+            used = _used_tokens(message)
+            _RATE_LIMITER.reconcile(reservation, used)
+            logger.debug(f"Claude usage for {url}: {used} tokens (estimated {reservation_estimate})")
+            return message
+        except anthropic.APIError as e:
+            retryable = _is_retryable_error(e)
+
+            if retryable and attempt < max_retries - 1:
+                wait_time = _retry_wait_seconds(e, attempt)
+                waited += wait_time
+                logger.warning(
+                    f"{type(e).__name__} for {url} (attempt {attempt + 1}/{max_retries}). "
+                    f"Waiting {wait_time:.1f}s before retry ({waited:.1f}s total)..."
+                )
+                await asyncio.sleep(wait_time)
+            else:
+                if retryable:
+                    logger.error(f"{type(e).__name__} for {url} after {max_retries} attempts: {e}")
+                else:
+                    logger.error(f"API error while extracting data from {url}: {e}")
                 return None
+    return None
 
-        def _find_array_bounds(text: str) -> tuple:
-            """Find start/end of top-level JSON array, respecting strings. Returns (start, end) or (-1, -1)."""
-            n = len(text)
-            # First pass: find candidate "[" that are not inside a string
-            in_str = False
-            q = None
-            escape = False
-            candidates = []
-            i = 0
-            while i < n:
-                c = text[i]
-                if escape:
-                    escape = False
-                    i += 1
-                    continue
-                if in_str:
-                    if c == "\\":
-                        escape = True
-                        i += 1
-                        continue
-                    if c == q:
-                        in_str = False
-                    i += 1
-                    continue
-                if c in '"\'':
-                    in_str = True
-                    q = c
-                    i += 1
-                    continue
-                if c == "[":
-                    candidates.append(i)
-                i += 1
-            # For first candidate, run string-aware bracket match
-            for start in candidates:
-                i = start + 1
-                depth = 1
-                in_double = False
-                in_single = False
-                escape = False
-                quote_char = None
-                while i < n and depth > 0:
-                    c = text[i]
-                    if escape:
-                        escape = False
-                        i += 1
-                        continue
-                    if (in_double or in_single) and c == "\\":
-                        escape = True
-                        i += 1
-                        continue
-                    if not in_double and not in_single:
-                        if c == "[":
-                            depth += 1
-                        elif c == "]":
-                            depth -= 1
-                            if depth == 0:
-                                return (start, i)
-                        elif c == '"':
-                            in_double = True
-                            quote_char = '"'
-                        elif c == "'":
-                            in_single = True
-                            quote_char = "'"
-                    elif c == quote_char:
-                        in_double = False
-                        in_single = False
-                    i += 1
-                if depth == 0:
-                    return (start, i - 1)
-            return (-1, -1)
 
-        products = None
+def _has_product_indicators(html_content: str) -> bool:
+    """Cheap check for price/product content, used to decide whether an empty result is worth a retry."""
+    return _PRODUCT_INDICATOR_RE.search(html_content) is not None
 
-        # Strategy 1: Direct parse
-        logger.debug(f"Strategy 1: Trying direct parse of response (length: {len(response_text)})")
-        products = _try_parse_json(response_text)
-        if products:
-            logger.debug(f"Strategy 1 SUCCESS: Found {len(products)} products")
-        else:
-            logger.debug("Strategy 1 FAILED: Direct parse returned None")
 
-        # Strategy 2: Markdown code blocks
-        if products is None:
-            logger.debug("Strategy 2: Trying markdown code block extraction")
-            for marker in ["```json", "```"]:
-                if marker in response_text:
-                    logger.debug(f"Found markdown marker: {marker}")
-                    try:
-                        parts = response_text.split(marker, 1)
-                        if len(parts) > 1:
-                            code_block = parts[1].split("```", 1)[0].strip()
-                            # Remove "json" prefix if present (from ```json marker)
-                            if code_block.startswith("json"):
-                                code_block = code_block[4:].strip()
-                            logger.debug(f"Extracted code block (length: {len(code_block)}, first 200: {code_block[:200]})")
-                            products = _try_parse_json(code_block)
-                            if products is not None:
-                                logger.debug(f"Strategy 2 SUCCESS with {marker}: Found {len(products)} products")
-                                break
-                            else:
-                                logger.debug(f"Strategy 2 FAILED with {marker}: _try_parse_json returned None, trying repair")
-                                # Try with repair
-                                repaired = _repair_json(code_block)
-                                products = _try_parse_json(repaired)
-                                if products is not None:
-                                    logger.debug(f"Strategy 2 SUCCESS with {marker} (after repair): Found {len(products)} products")
-                                    break
-                                else:
-                                    logger.debug(f"Strategy 2 FAILED with {marker} (even after repair)")
-                    except Exception as e:
-                        logger.debug(f"Strategy 2 exception with {marker}: {e}")
-                        continue
-
-        # Strategy 3: String-aware bracket matching for [...]
-        if products is None:
-            logger.debug("Strategy 3: Trying string-aware bracket matching")
-            start, end = _find_array_bounds(response_text)
-            if start != -1 and end > start:
-                json_candidate = response_text[start : end + 1]
-                logger.debug(f"Found array bounds: start={start}, end={end}, length={len(json_candidate)}")
-                products = _try_parse_json(json_candidate)
-                if products:
-                    logger.debug(f"Strategy 3 SUCCESS: Found {len(products)} products")
-                else:
-                    logger.debug("Strategy 3 FAILED: _try_parse_json returned None, trying repair")
-                    repaired = _repair_json(json_candidate)
-                    products = _try_parse_json(repaired)
-                    if products:
-                        logger.debug(f"Strategy 3 SUCCESS (after repair): Found {len(products)} products")
-                    else:
-                        logger.debug("Strategy 3 FAILED: Even after repair")
-            else:
-                logger.debug(f"Strategy 3 FAILED: No array bounds found (start={start}, end={end})")
-
-        # Strategy 4: Repair and retry bracket slice
-        if products is None and "[" in response_text and "{" in response_text:
-            start, end = _find_array_bounds(response_text)
-            if start != -1 and end > start:
-                json_candidate = _repair_json(response_text[start : end + 1])
-                products = _try_parse_json(json_candidate)
-
-        # Strategy 5: Extract product-like JSON objects and merge into list (handles truncated/malformed array)
-        if products is None and '"product_name"' in response_text:
-            logger.debug("Strategy 5: Trying object extraction")
-            _extracted = _extract_product_objects_from_text(response_text)
-            if _extracted:
-                logger.debug(f"Strategy 5 SUCCESS: Found {len(_extracted)} products")
-                products = _extracted
-            else:
-                logger.debug("Strategy 5 FAILED: No objects extracted")
+_PRODUCT_FIELDS_SPEC = """Required fields per product (use null if not found):
+- product_name (string) - REQUIRED, extract this even if other fields are missing
+- price_monthly (string with currency e.g. "£15.50" or null)
+- price_annual (string with currency or null)
+- excess (string or null)
+- features (array of strings)
+- special_offers (string or null)
+- terms_conditions (string or null)
+- category (string)"""
+
+
+def build_page_input(html_content: str) -> str:
+    """
+    The text a single-page extraction sends to Claude for this page.
+    Pages that differ only in markup Claude never sees (nonces, CSRF tokens, tracking
+    tags, script blobs) produce the same input, so callers can key duplicate work on it.
+    """
+    return _build_extraction_input(html_content, max_chars=120000)
+
+
+def _extraction_cache_key(url: str, html_content: str) -> str:
+    """
+    Cache key for a page's extracted products. Keyed on the raw page so a repeat scrape
+    of unchanged content is answered before any text stripping or windowing runs.
+    """
+    return TTLCache.make_key(ANTHROPIC_MODEL, url, html_content)
+
+
+def _build_extraction_prompt(url: str, html_for_analysis: str) -> str:
+    return f"""You are a data extraction expert. Analyze the following page content from {url} and extract ALL product/service offerings.
+
+CRITICAL: Your response must be ONLY a valid JSON array. No text before or after. No markdown code fences. No explanation. Use double quotes for keys and strings. Escape any quotes inside strings with backslash. Use null for missing values.
+
+IMPORTANT: Look carefully for product names, prices (look for £, $, currency symbols), plan names, coverage options. Extract even partial information if full details aren't available. Only return empty array [] if you are absolutely certain there are NO products/services mentioned anywhere in the page content.
+
+{_PRODUCT_FIELDS_SPEC}
+
+Example valid response (no other text):
+[{{"product_name": "Plan A", "price_monthly": "£10", "price_annual": "£120", "excess": "£50", "features": ["Cover 1"], "special_offers": null, "terms_conditions": null, "category": "Boiler"}}]
+
+Page content (the page title, any JSON-LD data and the visible text with markup removed, or the page's embedded JSON data; excerpts of long pages are separated by <!-- SNIP -->):
+{html_for_analysis}
+"""
+
+
+def extract_product_data(html_content: str, url: str, api_key: str, max_retries: int = 5) -> list:
+    """
+    Use Claude to intelligently extract product data from HTML.
+    Returns list of product dictionaries with extracted information.
+    
+    Args:
+        html_content: HTML content to analyze
+        url: Source URL for logging
+        api_key: Anthropic API key
+        max_retries: Maximum number of retries for rate limit errors
+    """
+    client = get_client(api_key)
+
+    cache_key = _extraction_cache_key(url, html_content)
+    cached = _EXTRACT_CACHE.get(cache_key)
+    if cached is not None:
+        logger.info(f"Using cached extraction for {url} ({len(cached)} products)")
+        return cached
+
+    # Smart extraction: includes prefix + windows around every £/$ and pricing phrase (not "first N chars").
+    # Use 60k to ensure all price blocks are captured. Rate limiting handled by delays between requests.
+    html_for_analysis = build_page_input(html_content)
+
+    prompt = _build_extraction_prompt(url, html_for_analysis)
+
+    message = _create_with_retry(client, prompt, url, max_retries=max_retries)
+    if message is None:
+        return []
+
+    try:
+        
+        response_text = message.content[0].text or ""
+        products = _parse_products_response(response_text)
 
         # If still not parsed, log and return empty list
         if products is None:
@@ -407,29 +792,16 @@ HTML Content:
         if len(products) == 0:
             logger.warning(f"No products extracted from {url} - checking if HTML contains price/product indicators...")
             # Check if HTML actually has price/product content before retrying
-            has_prices = bool(re.search(r"[£$€]\s*\d", html_content))
-            has_product_words = bool(re.search(r"\b(product|plan|cover|premium|option)", html_content, re.IGNORECASE))
-            
-            if has_prices or has_product_words:
+            if _has_product_indicators(html_content):
                 logger.info(f"HTML contains price/product indicators - retrying with focused extraction")
                 # Retry with a more focused extraction (still 50k to capture price blocks)
                 html_retry = _build_extraction_input(html_content, max_chars=50000)
                 try:
                     prompt_retry = prompt.replace(html_for_analysis, html_retry)
-                    msg = client.messages.create(
-                        model="claude-sonnet-4-5-20250929",
-                        max_tokens=2000,
-                        messages=[{"role": "user", "content": prompt_retry}],
-                    )
-                    response_retry = (msg.content[0].text or "").strip()
+                    msg = _create_with_retry(client, prompt_retry, url, max_retries=1)
+                    response_retry = (msg.content[0].text or "").strip() if msg is not None else ""
                     # Try all parsing strategies on retry response
-                    products = _try_parse_json(response_retry)
-                    if not products:
-                        start, end = _find_array_bounds(response_retry)
-                        if start != -1 and end > start:
-                            products = _try_parse_json(response_retry[start : end + 1])
-                    if not products:
-                        products = _extract_product_objects_from_text(response_retry)
+                    products = _parse_products_response(response_retry) or []
                     if products:
                         logger.info(f"Retry extracted {len(products)} products from {url}")
                     else:
@@ -440,6 +812,8 @@ HTML Content:
                 logger.info(f"HTML does not appear to contain price/product content - skipping retry")
         else:
             logger.info(f"Successfully extracted {len(products)} products from {url}")
+        if products:
+            _EXTRACT_CACHE.set(cache_key, products)
         return products
     
     except anthropic.APIError as e:
@@ -449,14 +823,195 @@ HTML Content:
         logger.error(f"Unexpected error extracting data from {url}: {e}")
         return []
 
+
+async def extract_product_data_async(
+    html_content: str,
+    url: str,
+    client: anthropic.AsyncAnthropic,
+    max_retries: int = 5,
+    page_input: Optional[str] = None,
+) -> list:
+    """
+    Async counterpart of `extract_product_data` for running many pages concurrently.
+    Takes a shared `AsyncAnthropic` client so all requests reuse one connection pool.
+    Pass `page_input` (from `build_page_input`) when the caller already built it, so it isn't built twice.
+    """
+    cache_key = _extraction_cache_key(url, html_content)
+    cached = _EXTRACT_CACHE.get(cache_key)
+    if cached is not None:
+        logger.info(f"Using cached extraction for {url} ({len(cached)} products)")
+        return cached
+
+    html_for_analysis = page_input if page_input is not None else build_page_input(html_content)
+
+    prompt = _build_extraction_prompt(url, html_for_analysis)
+    message = await _create_with_retry_async(client, prompt, url, max_retries=max_retries)
+    if message is None:
+        return []
+
+    try:
+        response_text = message.content[0].text or ""
+        products = _parse_products_response(response_text)
+        if products is None:
+            logger.error(f"JSON decode error for {url}: unable to parse response as JSON array")
+            logger.info(f"Response sample (first 1200 chars): {response_text[:1200]!r}")
+            return []
+
+        if not products and _has_product_indicators(html_content):
+            logger.info(f"No products extracted from {url} but HTML has price/product indicators - retrying with focused extraction")
+            html_retry = _build_extraction_input(html_content, max_chars=50000)
+            msg = await _create_with_retry_async(client, _build_extraction_prompt(url, html_retry), url, max_retries=1)
+            if msg is not None:
+                products = _parse_products_response((msg.content[0].text or "").strip()) or []
+
+        if products:
+            logger.info(f"Successfully extracted {len(products)} products from {url}")
+            _EXTRACT_CACHE.set(cache_key, products)
+        return products
+
+    except Exception as e:
+        logger.error(f"Unexpected error extracting data from {url}: {e}")
+        return []
+
+
+def _build_batch_extraction_prompt(pages: List[Tuple[str, str]]) -> str:
+    url_list = "\n".join(f"- {url}" for url, _ in pages)
+    sections = "\n\n".join(f"<!-- URL: {url} -->\n{page_input}" for url, page_input in pages)
+    return f"""You are a data extraction expert. Analyze the page content from each of the following pages and extract ALL product/service offerings, per page.
+
+Pages:
+{url_list}
+
+CRITICAL: Your response must be ONLY a valid JSON object mapping each page URL (exactly as listed above) to a JSON array of that page's products. No text before or after. No markdown code fences. No explanation. Use double quotes for keys and strings. Escape any quotes inside strings with backslash. Use null for missing values. Use [] for a page with no products.
+
+{_PRODUCT_FIELDS_SPEC}
+
+Example valid response (no other text):
+{{"https://example.com/a": [{{"product_name": "Plan A", "price_monthly": "£10", "price_annual": "£120", "excess": "£50", "features": ["Cover 1"], "special_offers": null, "terms_conditions": null, "category": "Boiler"}}], "https://example.com/b": []}}
+
+Page content (the page title, any JSON-LD data and the visible text with markup removed, or the page's embedded JSON data; each page starts with a <!-- URL: ... --> marker and excerpts of long pages are separated by <!-- SNIP -->):
+{sections}
+"""
+
+
+def _parse_batch_response(response_text: str) -> Optional[Dict[str, Any]]:
+    """Parse a batched reply into {url: products}. Returns None if no JSON object could be parsed."""
+    start = response_text.find("{")
+    end = response_text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    candidate = response_text[start : end + 1]
+    for attempt in (candidate, _repair_json(candidate)):
+        try:
+            out = _json_loads(attempt)
+        except json.JSONDecodeError:
+            continue
+        return out if isinstance(out, dict) else None
+    return None
+
+
+async def _extract_batch_async(
+    client: anthropic.AsyncAnthropic,
+    batch: List[Tuple[str, str, str, str]],
+    max_retries: int,
+) -> Dict[str, list]:
+    """Run one batched request; pages missing from the reply fall back to single-page extraction."""
+    label = ", ".join(url for url, _, _, _ in batch)
+    prompt = _build_batch_extraction_prompt([(url, page_input) for url, _, page_input, _ in batch])
+    message = await _create_with_retry_async(
+        client, prompt, label, max_tokens=2000 * len(batch), max_retries=max_retries, expect_array=False
+    )
+    parsed = _parse_batch_response(message.content[0].text or "") if message is not None else None
+    if parsed is None:
+        logger.warning(f"Could not parse batched response for {label}; falling back to per-page extraction")
+
+    results: Dict[str, list] = {}
+    for url, html_content, _, cache_key in batch:
+        products = parsed.get(url) if parsed else None
+        if isinstance(products, list):
+            products = [p for p in products if isinstance(p, dict)]
+            if products:
+                _EXTRACT_CACHE.set(cache_key, products)
+            results[url] = products
+        else:
+            results[url] = await extract_product_data_async(html_content, url, client, max_retries=max_retries)
+    return results
+
+
+def _pack_batches(
+    pending: List[Tuple[str, str, str, str]],
+    k: int,
+    max_chars: int,
+) -> List[List[Tuple[str, str, str, str]]]:
+    """
+    Group pages, in order, into batches of at most k pages whose extraction inputs
+    total at most max_chars. A page that fills the budget on its own is sent alone.
+    """
+    batches: List[List[Tuple[str, str, str, str]]] = []
+    batch: List[Tuple[str, str, str, str]] = []
+    batch_chars = 0
+    for item in pending:
+        size = len(item[2])
+        if batch and (len(batch) >= k or batch_chars + size > max_chars):
+            batches.append(batch)
+            batch, batch_chars = [], 0
+        batch.append(item)
+        batch_chars += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def extract_products_batched_async(
+    pairs: List[Tuple[str, str]],
+    api_key: str,
+    k: int = 4,
+    max_chars: int = 80000,
+    max_retries: int = 5,
+    concurrency: int = 2,
+) -> Dict[str, list]:
+    """
+    Extract products for several (url, html) pairs, packing up to k pages into each Claude request.
+
+    Pages are grouped in order until their extraction inputs would exceed `max_chars`,
+    so small pages share a request while a large page isn't cut down to an equal share.
+    The instructions are paid for once per batch.
+    Up to `concurrency` batches are in flight at once. Pages missing from a batched
+    reply fall back to single-page extraction.
+    Returns {url: [products...]}.
+    """
+    k = max(1, k)
+    results: Dict[str, list] = {}
+    pending: List[Tuple[str, str, str, str]] = []
+    for url, html_content in pairs:
+        cache_key = _extraction_cache_key(url, html_content)
+        cached = _EXTRACT_CACHE.get(cache_key)
+        if cached is not None:
+            results[url] = cached
+        else:
+            page_input = _build_extraction_input(html_content, max_chars=max_chars)
+            pending.append((url, html_content, page_input, cache_key))
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    async with new_async_client(api_key) as client:
+
+        async def run(batch: List[Tuple[str, str, str, str]]) -> Dict[str, list]:
+            async with semaphore:
+                return await _extract_batch_async(client, batch, max_retries)
+
+        for batch_results in await asyncio.gather(*(run(batch) for batch in _pack_batches(pending, k, max_chars))):
+            results.update(batch_results)
+    return results
+
+
 def generate_competitor_intelligence(products_data: Dict[str, Any], api_key: str) -> str:
     """
     Generate a comprehensive competitor intelligence summary from extracted product data.
     """
-    client = anthropic.Anthropic(api_key=api_key)
+    client = get_client(api_key)
     
-    # Prepare data summary for the agent
-    data_summary = json.dumps(products_data, indent=2)
+    # Prepare data summary for the agent (compact: indentation is billed as input tokens)
+    data_summary = json.dumps(products_data, separators=(",", ":"), ensure_ascii=False)
     
     prompt = f"""You are a business intelligence analyst. Analyze the following product data extracted from multiple competitor websites and provide a comprehensive competitor intelligence report.
 
@@ -489,12 +1044,13 @@ Generate a detailed report covering:
 Format the report with clear sections, bullet points where appropriate, and specific data references."""
 
     try:
-        message = client.messages.create(
+        message = _stream_message(
+            client,
             model="claude-sonnet-4-5-20250929",
             max_tokens=3000,
             messages=[
                 {"role": "user", "content": prompt}
-            ]
+            ],
         )
         
         return message.content[0].text
@@ -503,28 +1059,45 @@ Format the report with clear sections, bullet points where appropriate, and spec
         logger.error(f"API error while generating intelligence report: {e}")
         return "Error generating competitor intelligence report. Please try again."
 
-def validate_extracted_data(products: list) -> list:
+# Validated product schema: field -> default when the model omitted it (order is display order)
+_PRODUCT_TEMPLATE: Dict[str, Any] = {
+    "product_name": "Unknown",
+    "price_monthly": None,
+    "price_annual": None,
+    "excess": None,
+    "features": None,  # always replaced by a fresh list below
+    "special_offers": None,
+    "terms_conditions": None,
+    "category": "General",
+}
+_PRODUCT_KEYS = frozenset(_PRODUCT_TEMPLATE)
+
+
+def iter_validated_products(products: Iterable[Any]) -> Iterator[Dict[str, Any]]:
     """
-    Validate and clean extracted product data.
+    Validate and clean extracted products one at a time.
+    Lets callers finish each product (e.g. stamp its source URL) in the same pass
+    instead of materializing an intermediate validated list.
     """
-    validated_products = []
-    
+    # Loop-invariant lookups bound once; this runs for every product on every scrape
+    new_product = _PRODUCT_TEMPLATE.copy
+    known_keys = _PRODUCT_KEYS.intersection
+    is_instance = isinstance
     for product in products:
-        if not isinstance(product, dict):
+        if not is_instance(product, dict):
             continue
-        
-        # Ensure required fields exist
-        validated_product = {
-            "product_name": product.get("product_name", "Unknown"),
-            "price_monthly": product.get("price_monthly"),
-            "price_annual": product.get("price_annual"),
-            "excess": product.get("excess"),
-            "features": product.get("features", []) if isinstance(product.get("features"), list) else [],
-            "special_offers": product.get("special_offers"),
-            "terms_conditions": product.get("terms_conditions"),
-            "category": product.get("category", "General")
-        }
-        
-        validated_products.append(validated_product)
-    
-    return validated_products
\ No newline at end of file
+
+        # Ensure required fields exist: start from the defaults, then take the fields the model returned
+        validated = new_product()
+        for key in known_keys(product):
+            validated[key] = product[key]
+        if not is_instance(validated["features"], list):
+            validated["features"] = []
+        yield validated
+
+
+def validate_extracted_data(products: Iterable[Any]) -> list:
+    """
+    Validate and clean extracted product data.
+    """
+    return list(iter_validated_products(products))
@@ -1,14 +1,73 @@
+import asyncio
+import copy
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional, Tuple
-import anthropic
+import threading
+import weakref
+from collections import defaultdict
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
 import json
 import re
-import time
-from agents.llm_utils import extract_product_data, validate_extracted_data
+from urllib.parse import urlsplit
+from agents.llm_utils import (
+    build_page_input,
+    extract_product_data,
+    extract_product_data_async,
+    extract_products_batched_async,
+    iter_validated_products,
+    new_async_client,
+)
+from utils.cache import TTLCache
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is the fallback
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Next.js escapes "<" inside its embedded JSON, so [^<]* spans the payload without DOTALL backtracking
+_NEXT_DATA_RE = re.compile(r'<script id="__NEXT_DATA__"[^>]*>([^<]*)</script>')
+_NUMBER_RE = re.compile(r'[\d.]+')
+
+# Cap on bytes read per page, so a huge catalogue or a hostile response can't exhaust memory
+_MAX_BODY_BYTES = 5 * 1024 * 1024
+
+# Page content by URL; strings are immutable, so entries are shared rather than copied
+_PAGE_CACHE = TTLCache(maxsize=256, copy_values=False)
+
+_FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept": "text/html,application/xhtml+xml",
+    "Accept-Language": "en-GB,en;q=0.9",
+    # brotli and zstandard are required (requirements.txt), so this normally offers br and zstd;
+    # urllib3 still lists them only when importable, so a partial install never advertises
+    # an encoding it can't decode
+    "Accept-Encoding": ACCEPT_ENCODING,
+    "Connection": "keep-alive",
+}
+
+
+@dataclass(slots=True)
+class ScrapeError:
+    """A URL that produced no products, and why."""
+    url: str
+    error: str
+
+
+def _extract_numeric(price: Any) -> Optional[float]:
+    if not price:
+        return None
+    match = _NUMBER_RE.search(str(price))
+    return float(match.group()) if match else None
+
+
 class ScraperAgent:
     """
     Production-safe scraping agent for Streamlit Cloud.
@@ -22,15 +81,90 @@ class ScraperAgent:
     def __init__(self, api_key: str, model: str = "claude-sonnet-4-5-20250929"):
         self.api_key = api_key
         self.model = model
-        self.client = anthropic.Anthropic(api_key=api_key)
         self.extracted_data = {}
-        self.errors = []
+        self.errors: List[ScrapeError] = []
+        self.session = self._build_session()
+        # The pooled session lives as long as the agent, across scrape runs; it is closed
+        # by close() or, at the latest, when the agent is garbage-collected
+        self._close_session = weakref.finalize(self, self.session.close)
+
+    @staticmethod
+    def _build_session() -> requests.Session:
+        """
+        One pooled session per agent so URLs on the same host reuse the
+        TCP/TLS connection instead of handshaking per request.
+        """
+        session = requests.Session()
+        session.headers.update(_FETCH_HEADERS)
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            # raise_on_status=False hands the last response to raise_for_status, keeping the HTTP error messages
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                raise_on_status=False,
+            ),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self) -> None:
+        """Close the pooled HTTP session; call when the agent is being discarded."""
+        self._close_session()
 
     # ---------------------------------------------------------
     # FETCH HTML
     # ---------------------------------------------------------
 
     def fetch_url_content(self, url: str) -> Optional[str]:
+        """
+        Fetch page content, reusing a copy fetched within CACHE_TTL.
+        Extracted products are cached separately on URL + content, so an
+        unchanged page also skips the Claude call.
+        """
+        cached = _PAGE_CACHE.get(url)
+        if cached is not None:
+            logger.info(f"Using cached content for {url}")
+            return cached
+
+        content = self._download(url)
+        if content:
+            _PAGE_CACHE.set(url, content)
+        return content
+
+    @staticmethod
+    def _read_body(response: requests.Response, url: str) -> str:
+        """
+        Read the body in chunks, capped at _MAX_BODY_BYTES, and stop early once an
+        embedded __NEXT_DATA__ script has closed (that JSON is all we keep from such pages).
+        """
+        body = bytearray()
+        next_data_at = -1
+        for chunk in response.iter_content(chunk_size=65536):
+            scanned = len(body)
+            body += chunk
+            if len(body) >= _MAX_BODY_BYTES:
+                logger.warning(f"Response from {url} exceeds {_MAX_BODY_BYTES} bytes - truncating")
+                del body[_MAX_BODY_BYTES:]
+                break
+            # Re-check a few bytes before the new chunk so markers split across chunks are found
+            if next_data_at == -1:
+                next_data_at = body.find(b'id="__NEXT_DATA__"', max(0, scanned - 32))
+            if next_data_at != -1 and body.find(b"</script>", max(next_data_at, scanned - 16)) != -1:
+                break
+
+        # requests assumes ISO-8859-1 for text/* without a charset; pages are overwhelmingly UTF-8
+        content_type = response.headers.get("Content-Type", "").lower()
+        encoding = response.encoding if "charset" in content_type and response.encoding else "utf-8"
+        try:
+            return body.decode(encoding, errors="replace")
+        except LookupError:
+            return body.decode("utf-8", errors="replace")
+
+    def _download(self, url: str) -> Optional[str]:
         """
         Fetch HTML content.
         Also attempts to extract embedded JSON for React/Next.js sites.
@@ -38,30 +172,25 @@ class ScraperAgent:
         try:
             logger.info(f"Fetching content from {url}")
 
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-                "Accept": "text/html,application/xhtml+xml",
-                "Accept-Language": "en-GB,en;q=0.9",
-                "Connection": "keep-alive",
-            }
-
-            response = requests.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-
-            html = response.text
+            with self.session.get(url, timeout=(5, 30), stream=True) as response:
+                response.raise_for_status()
+                logger.debug(f"{url} served with Content-Encoding: {response.headers.get('Content-Encoding', 'identity')}")
+                html = self._read_body(response, url)
 
             # ---- Detect empty JS shell ----
             if "__NEXT_DATA__" in html:
                 logger.info(f"Detected Next.js site at {url} – extracting embedded JSON")
-                match = re.search(
-                    r'<script id="__NEXT_DATA__".*?>(.*?)</script>',
-                    html,
-                    re.DOTALL,
-                )
+                match = _NEXT_DATA_RE.search(html)
                 if match:
+                    # Validate only: the payload is already JSON text, and returning it as-is keeps
+                    # currency symbols literal (json.dumps would escape £ to \u00a3)
+                    next_data = match.group(1)
                     try:
-                        json_data = json.loads(match.group(1))
-                        return json.dumps(json_data)
+                        if orjson is not None:
+                            orjson.loads(next_data)
+                        else:
+                            json.loads(next_data)
+                        return next_data
                     except Exception:
                         logger.warning("Failed to parse __NEXT_DATA__ JSON")
 
@@ -80,13 +209,13 @@ class ScraperAgent:
             else:
                 error_msg = f"HTTP error fetching {url}: {str(e)}"
             logger.error(error_msg)
-            self.errors.append((url, error_msg))
+            self.errors.append(ScrapeError(url, error_msg))
             return None
 
         except Exception as e:
             error_msg = f"Unexpected fetch error for {url}: {str(e)}"
             logger.error(error_msg)
-            self.errors.append((url, error_msg))
+            self.errors.append(ScrapeError(url, error_msg))
             return None
 
     # ---------------------------------------------------------
@@ -96,11 +225,19 @@ class ScraperAgent:
     def scrape_single_url(
         self,
         url: str,
-        competitor_name: Optional[str] = None
+        competitor_name: Optional[str] = None,
+        host_limits: Optional[Dict[str, threading.Semaphore]] = None,
     ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
-
+        """
+        Fetch and extract one URL. With `host_limits` (netloc -> semaphore), the download
+        holds its host's semaphore, as in the async path.
+        """
         try:
-            html_content = self.fetch_url_content(url)
+            if host_limits is None:
+                html_content = self.fetch_url_content(url)
+            else:
+                with host_limits[urlsplit(url).netloc.lower()]:
+                    html_content = self.fetch_url_content(url)
             if not html_content:
                 return None, f"Could not fetch content from {url}"
 
@@ -110,29 +247,78 @@ class ScraperAgent:
                 self.api_key
             )
 
-            if not products:
-                logger.warning(
-                    f"No products extracted. HTML sample:\n"
-                    f"{html_content[:1000]}"
-                )
-                return None, f"No products extracted from {url}"
+            return self._finalize_products(url, html_content, products, competitor_name)
+
+        except Exception as e:
+            error_msg = f"Error processing {url}: {str(e)}"
+            logger.error(error_msg)
+            return None, error_msg
 
-            validated_products = validate_extracted_data(products)
+    async def _fetch_async(
+        self,
+        url: str,
+        host_limits: Optional[Dict[str, asyncio.Semaphore]] = None,
+    ) -> Optional[str]:
+        """
+        Run the blocking fetch in a worker thread. With `host_limits`, the download holds
+        its host's semaphore, so one site is never hit by more than a few requests at once.
+        """
+        if host_limits is None:
+            return await asyncio.to_thread(self.fetch_url_content, url)
+        async with host_limits[urlsplit(url).netloc.lower()]:
+            return await asyncio.to_thread(self.fetch_url_content, url)
 
-            for product in validated_products:
-                product["source_url"] = url
-                if competitor_name:
-                    product["competitor"] = competitor_name
+    async def _scrape_single_url_async(
+        self,
+        extract: Callable[[str, str], Awaitable[List[Dict[str, Any]]]],
+        url: str,
+        competitor_name: Optional[str] = None,
+        host_limits: Optional[Dict[str, asyncio.Semaphore]] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Async counterpart of `scrape_single_url`: the blocking fetch runs in a worker thread,
+        then `extract(html_content, url)` produces the products.
+        """
+        try:
+            html_content = await self._fetch_async(url, host_limits)
+            if not html_content:
+                return None, f"Could not fetch content from {url}"
 
-            logger.info(f"Extracted {len(validated_products)} products from {url}")
+            products = await extract(html_content, url)
 
-            return {"url": url, "products": validated_products}, None
+            return self._finalize_products(url, html_content, products, competitor_name)
 
         except Exception as e:
             error_msg = f"Error processing {url}: {str(e)}"
             logger.error(error_msg)
             return None, error_msg
 
+    @staticmethod
+    def _finalize_products(
+        url: str,
+        html_content: str,
+        products: List[Dict[str, Any]],
+        competitor_name: Optional[str],
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        if not products:
+            logger.warning(
+                f"No products extracted. HTML sample:\n"
+                f"{html_content[:1000]}"
+            )
+            return None, f"No products extracted from {url}"
+
+        # Validate and stamp provenance in a single pass
+        validated_products = []
+        for product in iter_validated_products(products):
+            product["source_url"] = url
+            if competitor_name:
+                product["competitor"] = competitor_name
+            validated_products.append(product)
+
+        logger.info(f"Extracted {len(validated_products)} products from {url}")
+
+        return {"url": url, "products": validated_products}, None
+
     # ---------------------------------------------------------
     # SCRAPE MULTIPLE
     # ---------------------------------------------------------
@@ -142,36 +328,227 @@ class ScraperAgent:
         urls: List[str],
         progress_callback=None,
         url_to_competitor: Optional[Dict[str, str]] = None,
-    ) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
+        concurrency: int = 4,
+        batch_size: int = 1,
+        per_host: int = 2,
+    ) -> Tuple[Dict[str, Any], List[ScrapeError]]:
+        """
+        Scrape and extract several URLs, up to `concurrency` at a time and at most
+        `per_host` concurrent downloads from any one site.
+        Rate-limited Claude calls back off and retry inside the extraction helpers.
+        With batch_size > 1, pages are fetched first and then packed up to batch_size per
+        Claude request, so the extraction instructions are paid for once per batch.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # asyncio.run() can't nest inside a running loop (notebooks, async hosts); use threads there
+            if batch_size > 1:
+                logger.warning(
+                    f"batch_size={batch_size} is ignored inside a running event loop; extracting one page per request"
+                )
+            return self._scrape_multiple_urls_threaded(
+                urls,
+                progress_callback=progress_callback,
+                url_to_competitor=url_to_competitor,
+                concurrency=concurrency,
+                per_host=per_host,
+            )
 
-        all_results = {}
-        errors = []
+        return asyncio.run(
+            self.scrape_multiple_urls_async(
+                urls,
+                progress_callback=progress_callback,
+                url_to_competitor=url_to_competitor,
+                concurrency=concurrency,
+                batch_size=batch_size,
+                per_host=per_host,
+            )
+        )
 
-        for index, url in enumerate(urls):
+    def _scrape_multiple_urls_threaded(
+        self,
+        urls: List[str],
+        progress_callback=None,
+        url_to_competitor: Optional[Dict[str, str]] = None,
+        concurrency: int = 4,
+        per_host: int = 2,
+    ) -> Tuple[Dict[str, Any], List[ScrapeError]]:
+        """
+        Thread-pool variant of `scrape_multiple_urls_async` for callers that already run an event loop.
+        Page fetches and the blocking Claude client both wait on I/O, so worker threads overlap them too.
+        """
+        outcomes: Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]] = {}
+        # Built up front: worker threads only read the mapping, so no lazy insertion races
+        host_limits = {
+            netloc: threading.Semaphore(max(1, per_host))
+            for netloc in {urlsplit(url).netloc.lower() for url in urls}
+        }
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(urls)))) as pool:
+            futures = {
+                pool.submit(
+                    self.scrape_single_url,
+                    url,
+                    url_to_competitor.get(url) if url_to_competitor else None,
+                    host_limits,
+                ): url
+                for url in urls
+            }
+            # Progress is reported from the calling thread, where Streamlit widgets can be updated
+            for completed, future in enumerate(as_completed(futures)):
+                url = futures[future]
+                outcomes[url] = future.result()
+                if progress_callback:
+                    progress_callback(url, completed, len(urls))
 
-            if progress_callback:
-                progress_callback(url, index, len(urls))
+        return self._store_outcomes(urls, [outcomes[url] for url in urls])
 
-            competitor_name = (
-                url_to_competitor.get(url)
-                if url_to_competitor
-                else None
+    async def scrape_multiple_urls_async(
+        self,
+        urls: List[str],
+        progress_callback=None,
+        url_to_competitor: Optional[Dict[str, str]] = None,
+        concurrency: int = 4,
+        batch_size: int = 1,
+        per_host: int = 2,
+    ) -> Tuple[Dict[str, Any], List[ScrapeError]]:
+
+        if batch_size > 1:
+            return await self._scrape_batched_async(
+                urls,
+                progress_callback=progress_callback,
+                url_to_competitor=url_to_competitor,
+                concurrency=concurrency,
+                batch_size=batch_size,
+                per_host=per_host,
             )
 
-            result, error = self.scrape_single_url(
-                url,
-                competitor_name=competitor_name
-            )
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        host_limits = defaultdict(lambda: asyncio.Semaphore(max(1, per_host)))
+        completed = 0
+        # Pages that reduce to the same extraction input (tracking-param variants, redirects to
+        # one canonical page, pages differing only in nonces or script blobs) share a single
+        # extraction: later URLs await the first one's result
+        extractions: Dict[str, "asyncio.Future[List[Dict[str, Any]]]"] = {}
+        dedup_hits = 0
+
+        async with new_async_client(self.api_key) as client:
+
+            async def extract_once(html_content: str, url: str) -> List[Dict[str, Any]]:
+                nonlocal dedup_hits
+                # Built once here and handed to the extractor, which would otherwise build it again
+                page_input = build_page_input(html_content)
+                digest = hashlib.blake2b(page_input.encode("utf-8"), digest_size=16).hexdigest()
+                shared = extractions.get(digest)
+                if shared is not None:
+                    dedup_hits += 1
+                    logger.info(f"Reusing extraction for identical page content at {url}")
+                    # Validation keeps nested lists (features), so give each URL its own copy
+                    return copy.deepcopy(await shared)
+
+                extractions[digest] = asyncio.get_running_loop().create_future()
+                products: List[Dict[str, Any]] = []
+                try:
+                    products = await extract_product_data_async(html_content, url, client, page_input=page_input)
+                finally:
+                    extractions[digest].set_result(products)
+                return products
+
+            async def run(url: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+                nonlocal completed
+                competitor_name = (
+                    url_to_competitor.get(url)
+                    if url_to_competitor
+                    else None
+                )
+                async with semaphore:
+                    outcome = await self._scrape_single_url_async(
+                        extract_once,
+                        url,
+                        competitor_name=competitor_name,
+                        host_limits=host_limits,
+                    )
+                # Callbacks run on the event loop thread, so Streamlit widgets can be updated here
+                if progress_callback:
+                    progress_callback(url, completed, len(urls))
+                completed += 1
+                return outcome
+
+            outcomes = await asyncio.gather(*(run(url) for url in urls))
+
+        if dedup_hits:
+            logger.info(f"Skipped {dedup_hits} extraction(s) for pages with identical extraction input")
+
+        return self._store_outcomes(urls, outcomes)
+
+    async def _scrape_batched_async(
+        self,
+        urls: List[str],
+        progress_callback=None,
+        url_to_competitor: Optional[Dict[str, str]] = None,
+        concurrency: int = 4,
+        batch_size: int = 4,
+        per_host: int = 2,
+    ) -> Tuple[Dict[str, Any], List[ScrapeError]]:
+        """
+        Fetch every page, then extract them in multi-page Claude requests.
+        Progress is reported once extraction finishes, as each URL's products are finalised.
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        host_limits = defaultdict(lambda: asyncio.Semaphore(max(1, per_host)))
+
+        async def fetch(url: str) -> Tuple[Optional[str], Optional[str]]:
+            async with semaphore:
+                try:
+                    return await self._fetch_async(url, host_limits), None
+                except Exception as e:
+                    error_msg = f"Error processing {url}: {str(e)}"
+                    logger.error(error_msg)
+                    return None, error_msg
+
+        fetched = await asyncio.gather(*(fetch(url) for url in urls))
+
+        pairs = [(url, html_content) for url, (html_content, _) in zip(urls, fetched) if html_content]
+        products_by_url = (
+            await extract_products_batched_async(pairs, self.api_key, k=batch_size, concurrency=concurrency)
+            if pairs
+            else {}
+        )
+
+        outcomes = []
+        for completed, (url, (html_content, error)) in enumerate(zip(urls, fetched)):
+            if error:
+                outcomes.append((None, error))
+            elif not html_content:
+                outcomes.append((None, f"Could not fetch content from {url}"))
+            else:
+                competitor_name = url_to_competitor.get(url) if url_to_competitor else None
+                outcomes.append(
+                    self._finalize_products(url, html_content, products_by_url.get(url, []), competitor_name)
+                )
+            if progress_callback:
+                progress_callback(url, completed, len(urls))
+
+        return self._store_outcomes(urls, outcomes)
+
+    def _store_outcomes(
+        self,
+        urls: List[str],
+        outcomes: List[Tuple[Optional[Dict[str, Any]], Optional[str]]],
+    ) -> Tuple[Dict[str, Any], List[ScrapeError]]:
+        all_results = {}
+        errors: List[ScrapeError] = []
 
+        # Report in input order regardless of completion order
+        for url, (result, error) in zip(urls, outcomes):
             if result:
                 all_results[url] = result["products"]
 
             if error:
-                errors.append({"url": url, "error": error})
-
-            # Slight delay to avoid Claude rate limits
-            if index < len(urls) - 1:
-                time.sleep(6)
+                errors.append(ScrapeError(url, error))
 
         self.extracted_data = all_results
         self.errors = errors
@@ -190,30 +567,25 @@ class ScraperAgent:
 
     def get_summary_statistics(self) -> Dict[str, Any]:
 
-        all_products = self.get_all_products_flat()
-
-        def extract_numeric(price):
-            if not price:
-                return None
-            match = re.search(r'[\d.]+', str(price))
-            return float(match.group()) if match else None
-
-        monthly = [
-            extract_numeric(p.get("price_monthly"))
-            for p in all_products
-            if p.get("price_monthly")
-        ]
-        monthly = [m for m in monthly if m is not None]
+        # One pass with running totals; no flattened product list or intermediate price lists
+        total_products = 0
+        monthly_sum = 0.0
+        monthly_count = 0
+        for products in self.extracted_data.values():
+            total_products += len(products)
+            for p in products:
+                monthly = _extract_numeric(p.get("price_monthly"))
+                if monthly is not None:
+                    monthly_sum += monthly
+                    monthly_count += 1
 
         return {
             "total_urls_scraped": len(self.extracted_data),
-            "total_products": len(all_products),
+            "total_products": total_products,
             "errors_count": len(self.errors),
-            "urls_with_data": len(
-                [u for u, p in self.extracted_data.items() if p]
-            ),
+            "urls_with_data": sum(1 for p in self.extracted_data.values() if p),
             "avg_monthly_price": (
-                sum(monthly) / len(monthly)
-                if monthly else None
+                monthly_sum / monthly_count
+                if monthly_count else None
             ),
         }
\ No newline at end of file
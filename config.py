@@ -6,10 +6,18 @@ load_dotenv()
 # Anthropic API Configuration
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 ANTHROPIC_MODEL = "claude-sonnet-4-5-20250929"
+# Request latency-optimized inference (Bedrock performanceConfig); leave off for endpoints/models that reject it
+LATENCY_OPTIMIZED_INFERENCE = os.getenv("ANTHROPIC_LATENCY_OPTIMIZED", "false").lower() in ("1", "true", "yes")
+# Account rate limits for Claude calls (requests/min, input+output tokens/min)
+ANTHROPIC_RPM = int(os.getenv("ANTHROPIC_RPM", "50"))
+ANTHROPIC_TPM = int(os.getenv("ANTHROPIC_TPM", "80000"))
 
 # App Configuration
 APP_TITLE = "AI Powered Competitor Intelligence"
 APP_DESCRIPTION = "Scrape, normalize and benchmark competitor products and pricing with an AI-powered intelligence workspace."
+# Static assets, checked once per process (the Streamlit script itself re-runs on every interaction)
+LOGO_PATH = "logo.svg" if os.path.exists("logo.svg") else None
+THINGS_PATH = "things.png" if os.path.exists("things.png") else None
 
 # Scraping Configuration
 MAX_URLS_PER_BATCH = 50
@@ -1,21 +1,27 @@
 import streamlit as st
 import logging
-from typing import List, Dict, Any
-import os
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
+import io
+import time
+import uuid
 from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Import modules
-from config import ANTHROPIC_API_KEY, APP_TITLE, APP_DESCRIPTION
-from agents.scraper_agent import ScraperAgent
-from agents.competitor_intelligence import CompetitorIntelligenceAgent
+from config import ANTHROPIC_API_KEY, APP_TITLE, APP_DESCRIPTION, LOGO_PATH, THINGS_PATH
 from utils.url_processor import validate_url, deduplicate_urls
 from utils.file_handler import parse_csv_urls, parse_text_urls, export_products_to_csv
-from utils.table_formatter import format_products_as_dataframe, format_summary_statistics, format_errors_as_dataframe
-from utils.report_export import export_report_to_docx
+# The agents (anthropic SDK, requests), table formatting (pandas) and exporters are imported
+# where they're first used, so the upload page paints without loading them
+
+if TYPE_CHECKING:
+    from agents.competitor_intelligence import CompetitorIntelligenceAgent
+    from agents.scraper_agent import ScraperAgent
 
 # Page configuration
 st.set_page_config(
@@ -25,90 +31,13 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# Global theme & layout CSS
-st.markdown(
-    """
-<style>
-    :root {
-        --primary-pink: #d03e9d;
-        --primary-navy: #08216b;
-        --bg-soft: #f5f7fb;
-        --card-bg: #ffffff;
-        --accent-soft: #fbe7f4;
-        --border-subtle: rgba(8, 33, 107, 0.06);
-        --text-muted: #4b5878;
-    }
-
-    html, body, [data-testid="stApp"] {
-        background: radial-gradient(circle at top left, #fbe7f4 0, #f5f7fb 35%, #ffffff 100%);
-    }
-
-    .app-header-title {
-        color: var(--primary-navy);
-        font-size: 2.2rem;
-        font-weight: 700;
-        letter-spacing: 0.02em;
-        margin-bottom: 0.25rem;
-    }
-
-    .app-header-subtitle {
-        color: var(--text-muted);
-        font-size: 0.98rem;
-        max-width: 34rem;
-        line-height: 1.5;
-        margin-bottom: 0.5rem;
-    }
-
-    .brand-pill {
-        display: inline-flex;
-        align-items: center;
-        gap: 0.35rem;
-        padding: 0.15rem 0.75rem;
-        border-radius: 999px;
-        background: rgba(208, 62, 157, 0.08);
-        color: var(--primary-pink);
-        font-size: 0.78rem;
-        font-weight: 600;
-        text-transform: uppercase;
-        letter-spacing: 0.09em;
-        margin-bottom: 0.5rem;
-    }
-
-    /* Tweak tabs to feel more like an analytics workspace */
-    [data-testid="stTabs"] button {
-        font-weight: 600;
-        border-radius: 999px !important;
-        padding: 0.4rem 1.2rem !important;
-    }
-
-    [data-testid="stTabs"] button[aria-selected="true"] {
-        background: linear-gradient(90deg, var(--primary-navy), var(--primary-pink));
-        color: #ffffff !important;
-    }
-
-    [data-testid="stMetricValue"] {
-        color: var(--primary-navy);
-    }
-
-    [data-testid="stMetricLabel"] {
-        color: var(--text-muted);
-    }
+# Global theme & layout CSS (assets/theme.css, read once per process rather than on every rerun)
+@st.cache_resource(show_spinner=False)
+def load_theme_css() -> str:
+    return (Path(__file__).parent / "assets" / "theme.css").read_text(encoding="utf-8")
 
-    /* Softer data frame background */
-    [data-testid="stDataFrame"] {
-        border-radius: 0.5rem;
-        border: 1px solid var(--border-subtle);
-        background-color: var(--card-bg);
-    }
 
-    .section-header {
-        font-weight: 600;
-        color: var(--primary-navy);
-    }
-</style>
-""",
-    unsafe_allow_html=True,
-)
+st.markdown(f"<style>\n{load_theme_css()}</style>", unsafe_allow_html=True)
 
 # Initialize session state
 if "scraper_agent" not in st.session_state:
@@ -123,14 +52,146 @@ if "intelligence_report" not in st.session_state:
     st.session_state.intelligence_report = None
 if "intelligence_report_type" not in st.session_state:
     st.session_state.intelligence_report_type = None
+if "results_id" not in st.session_state:
+    st.session_state.results_id = None
+if "parsed_urls" not in st.session_state:
+    st.session_state.parsed_urls = None
+
+
+# Streamlit reruns the whole script on every widget interaction; cache the derived views per
+# scrape run. results_id changes whenever new results are stored, and the leading underscore
+# keeps Streamlit from hashing the agent itself.
+@st.cache_data(ttl=600, show_spinner=False)
+def cached_summary_statistics(results_id: str, _agent: "ScraperAgent") -> Dict[str, Any]:
+    return _agent.get_summary_statistics()
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def cached_products_dataframe(results_id: str, _agent: "ScraperAgent"):
+    from utils.table_formatter import format_products_as_dataframe
+
+    all_products = _agent.get_all_products_flat()
+    if not all_products:
+        return None
+    return format_products_as_dataframe(all_products, dedupe=True)
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def cached_products_csv(results_id: str, compress: bool, _agent: "ScraperAgent") -> bytes:
+    return export_products_to_csv(_agent.get_all_products_flat(), compress=compress)
+
+
+# Keyed on the report text itself; a new report (or report type) is a new key
+@st.cache_data(ttl=600, show_spinner=False)
+def cached_report_docx(report: str, logo_path: Optional[str], title: str) -> bytes:
+    from utils.report_export import export_report_to_docx
+
+    return export_report_to_docx(report, logo_path=logo_path, title=title)
+
+
+# The report agent holds no per-user state, so one instance per API key is shared by all sessions
+@st.cache_resource(show_spinner=False)
+def get_intelligence_agent(api_key: str) -> "CompetitorIntelligenceAgent":
+    from agents.competitor_intelligence import CompetitorIntelligenceAgent
+
+    return CompetitorIntelligenceAgent(api_key=api_key)
+
+
+def make_progress_callback(progress_bar, status_text, min_interval: float = 0.25):
+    """
+    Scrape progress callback that repaints at most every `min_interval` seconds
+    (each update is a round-trip to the browser); the final URL always paints.
+    """
+    last_paint = 0.0
+
+    def progress_callback(url, index, total):
+        nonlocal last_paint
+        now = time.monotonic()
+        if index + 1 < total and now - last_paint < min_interval:
+            return
+        last_paint = now
+        progress_bar.progress((index + 1) / total)
+        status_text.text(f"Processing {index + 1}/{total}: {url[:50]}...")
+
+    return progress_callback
+
+
+def get_scraper_agent() -> "ScraperAgent":
+    """
+    Reuse this session's agent, and its pooled HTTP session, across runs.
+    Kept per session rather than in st.cache_resource: the agent holds that user's results.
+    An agent built for a different API key is closed and replaced.
+    """
+    agent = st.session_state.scraper_agent
+    if agent is not None and agent.api_key != ANTHROPIC_API_KEY:
+        agent.close()
+        agent = None
+    if agent is None:
+        from agents.scraper_agent import ScraperAgent
+
+        agent = st.session_state.scraper_agent = ScraperAgent(api_key=ANTHROPIC_API_KEY)
+    return agent
+
+
+# Keyed on the raw upload bytes / pasted text, so reruns don't re-read the CSV on every keystroke
+@st.cache_data(ttl=600, show_spinner=False)
+def cached_parse_csv_urls(file_bytes: bytes) -> List[Dict[str, Any]]:
+    return parse_csv_urls(io.BytesIO(file_bytes))
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def cached_plan_csv_rows(file_bytes: bytes) -> Dict[str, Any]:
+    """
+    Validate, dedupe and label the uploaded CSV rows in a single pass.
+    Returns the unique valid rows ({"url", "competitor", "is_british_gas"}, first row per URL),
+    the valid-row count, the invalid URLs and the competitor names offered for selection.
+    """
+    rows: Dict[str, Dict[str, Any]] = {}
+    invalid_urls: List[str] = []
+    names = set()
+    valid_count = 0
+
+    for row in cached_parse_csv_urls(file_bytes):
+        url_val = row["url"]
+        if not validate_url(url_val):
+            invalid_urls.append(url_val)
+            continue
+        valid_count += 1
+        if url_val in rows:
+            continue
+
+        comp_name = (row.get("competitor") or "").strip()
+        bg_name = "british gas" in comp_name.lower()
+        rows[url_val] = {
+            "url": url_val,
+            "competitor": comp_name,
+            # British Gas by competitor label, else by domain (urlsplit only when needed)
+            "is_british_gas": bg_name or "britishgas.co.uk" in urlsplit(url_val).netloc.lower(),
+        }
+        # British Gas is always scraped, so it isn't offered as a choice
+        if comp_name and not bg_name:
+            names.add(comp_name)
+
+    return {
+        "rows": list(rows.values()),
+        "valid_count": valid_count,
+        "invalid_urls": invalid_urls,
+        "competitor_names": sorted(names),
+    }
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def cached_parse_text_urls(text: str) -> List[str]:
+    return parse_text_urls(text)
+
 
 def main():
     # Header with branding
     with st.container():
         left, right = st.columns([3, 2])
         with left:
-            if os.path.exists("logo.svg"):
-                st.image("logo.svg", width=170)
+            if LOGO_PATH:
+                st.image(LOGO_PATH, width=170)
             st.markdown(
                 "<div class='brand-pill'>AI workspace</div>",
                 unsafe_allow_html=True,
@@ -144,8 +205,8 @@ def main():
                 unsafe_allow_html=True,
             )
         with right:
-            if os.path.exists("things.png"):
-                st.image("things.png", width ="content")
+            if THINGS_PATH:
+                st.image(THINGS_PATH, width ="content")
     
     # Check API key
     if not ANTHROPIC_API_KEY:
@@ -178,7 +239,7 @@ def main():
             
             csv_rows = None
             if uploaded_file:
-                csv_rows = parse_csv_urls(uploaded_file)
+                csv_rows = cached_parse_csv_urls(uploaded_file.getvalue())
                 st.success(f"✓ Parsed {len(csv_rows)} rows from CSV")
         
         with col2:
@@ -191,46 +252,33 @@ def main():
             
             text_urls = None
             if text_input.strip():
-                text_urls = parse_text_urls(text_input)
+                text_urls = cached_parse_text_urls(text_input)
                 st.success(f"✓ Parsed {len(text_urls)} URLs from text")
         
+        st.session_state.parsed_urls = csv_rows if uploaded_file and csv_rows else text_urls
+        
         # Prefer CSV workflow when a file is uploaded; otherwise fall back to text URLs
         if uploaded_file and csv_rows:
             # Validate URLs from CSV
             st.subheader("URL Validation")
-            valid_rows = [row for row in csv_rows if validate_url(row["url"])]
-            invalid_rows = [row for row in csv_rows if not validate_url(row["url"])]
+            # Validation, dedupe and British Gas labelling are done once per upload, not per rerun
+            plan = cached_plan_csv_rows(uploaded_file.getvalue())
+            final_rows = plan["rows"]
+            invalid_urls = plan["invalid_urls"]
+            competitor_names = plan["competitor_names"]
             
             col1, col2 = st.columns(2)
             with col1:
-                st.success(f"✓ Valid URLs: {len(valid_rows)}")
+                st.success(f"✓ Valid URLs: {plan['valid_count']}")
             with col2:
-                if invalid_rows:
-                    st.warning(f"⚠ Invalid URLs: {len(invalid_rows)}")
+                if invalid_urls:
+                    st.warning(f"⚠ Invalid URLs: {len(invalid_urls)}")
                     with st.expander("Show invalid URLs"):
-                        for row in invalid_rows:
-                            st.text(row["url"])
-
-            # Deduplicate by URL while preserving competitor names
-            seen = set()
-            final_rows = []
-            for row in valid_rows:
-                url_val = row["url"]
-                if url_val not in seen:
-                    seen.add(url_val)
-                    final_rows.append(row)
+                        for url in invalid_urls:
+                            st.text(url)
 
             st.info(f"Processing {len(final_rows)} unique URLs")
 
-            # Build competitor list for selection (exclude British Gas, which is always included)
-            competitor_names = sorted(
-                {
-                    (row.get("competitor") or "").strip()
-                    for row in final_rows
-                    if row.get("competitor") and "british gas" not in row.get("competitor", "").strip().lower()
-                }
-            )
-
             selected_competitors = []
             if competitor_names:
                 selected_competitors = st.multiselect(
@@ -244,29 +292,20 @@ def main():
             if st.button("🚀 Start Scraping", key="scrape_btn", type="primary"):
                 st.session_state.processing_complete = False
                 
-                with st.spinner("🔄 Initializing scraper..."):
-                    st.session_state.scraper_agent = ScraperAgent(api_key=ANTHROPIC_API_KEY)
+                get_scraper_agent()
                 
                 # Decide which URLs to scrape based on competitor selection
-                from urllib.parse import urlparse
-
-                def is_british_gas(row: Dict[str, Any]) -> bool:
-                    comp = (row.get("competitor") or "").lower()
-                    if "british gas" in comp:
-                        return True
-                    domain = urlparse(row["url"]).netloc.lower()
-                    return "britishgas.co.uk" in domain
-
                 urls_to_scrape = []
                 url_to_competitor = {}
+                selected = set(selected_competitors)
 
                 for row in final_rows:
                     url_val = row["url"]
-                    comp_name = (row.get("competitor") or "").strip()
-                    bg = is_british_gas(row)
+                    comp_name = row["competitor"]
+                    bg = row["is_british_gas"]
 
                     # Always include British Gas URLs; for others, filter by selected competitors (if any)
-                    if bg or not selected_competitors or comp_name in selected_competitors:
+                    if bg or not selected or comp_name in selected:
                         urls_to_scrape.append(url_val)
                         label = comp_name or ("British Gas" if bg else "")
                         url_to_competitor[url_val] = label
@@ -275,10 +314,7 @@ def main():
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
-                def progress_callback(url, index, total):
-                    progress = (index + 1) / total
-                    progress_bar.progress(progress)
-                    status_text.text(f"Processing {index + 1}/{total}: {url[:50]}...")
+                progress_callback = make_progress_callback(progress_bar, status_text)
                 
                 # Scrape URLs
                 with st.spinner("📡 Scraping and extracting product data..."):
@@ -291,6 +327,7 @@ def main():
                 # Store results in session state
                 st.session_state.extracted_products = results
                 st.session_state.extraction_errors = errors
+                st.session_state.results_id = uuid.uuid4().hex
                 st.session_state.processing_complete = True
                 
                 progress_bar.empty()
@@ -302,8 +339,10 @@ def main():
         elif text_urls:
             # Text-based workflow (no competitor metadata)
             st.subheader("URL Validation")
-            valid_urls = [u for u in text_urls if validate_url(u)]
-            invalid_urls = [u for u in text_urls if not validate_url(u)]
+            valid_urls, invalid_urls = [], []
+            add_valid, add_invalid = valid_urls.append, invalid_urls.append
+            for u in st.session_state.parsed_urls:
+                (add_valid if validate_url(u) else add_invalid)(u)
 
             col1, col2 = st.columns(2)
             with col1:
@@ -321,16 +360,12 @@ def main():
             if st.button("🚀 Start Scraping", key="scrape_btn_text", type="primary"):
                 st.session_state.processing_complete = False
 
-                with st.spinner("🔄 Initializing scraper..."):
-                    st.session_state.scraper_agent = ScraperAgent(api_key=ANTHROPIC_API_KEY)
+                get_scraper_agent()
 
                 progress_bar = st.progress(0)
                 status_text = st.empty()
 
-                def progress_callback(url, index, total):
-                    progress = (index + 1) / total
-                    progress_bar.progress(progress)
-                    status_text.text(f"Processing {index + 1}/{total}: {url[:50]}...")
+                progress_callback = make_progress_callback(progress_bar, status_text)
 
                 with st.spinner("📡 Scraping and extracting product data..."):
                     results, errors = st.session_state.scraper_agent.scrape_multiple_urls(
@@ -340,6 +375,7 @@ def main():
 
                 st.session_state.extracted_products = results
                 st.session_state.extraction_errors = errors
+                st.session_state.results_id = uuid.uuid4().hex
                 st.session_state.processing_complete = True
 
                 progress_bar.empty()
@@ -357,7 +393,7 @@ def main():
         else:
             # Summary statistics
             st.subheader("📊 Summary Statistics")
-            stats = st.session_state.scraper_agent.get_summary_statistics()
+            stats = cached_summary_statistics(st.session_state.results_id, st.session_state.scraper_agent)
             
             col1, col2, col3, col4, col5 = st.columns(5)
             with col1:
@@ -376,16 +412,17 @@ def main():
             # Products table
             st.subheader("📋 Extracted Products")
             
-            all_products = st.session_state.scraper_agent.get_all_products_flat()
+            df = cached_products_dataframe(st.session_state.results_id, st.session_state.scraper_agent)
             
-            if all_products:
-                df = format_products_as_dataframe(all_products, dedupe=True)
+            if df is not None:
                 st.dataframe(df, use_container_width=True, height=400)
             else:
                 st.warning("No products extracted from the URLs")
             
             # Errors
             if st.session_state.extraction_errors:
+                from utils.table_formatter import format_errors_as_dataframe
+
                 st.subheader("⚠️ Extraction Errors")
                 errors_df = format_errors_as_dataframe(st.session_state.extraction_errors)
                 st.dataframe(errors_df, use_container_width=True)
@@ -404,14 +441,25 @@ def main():
                 ["Full Detailed Report", "Executive Summary"]
             )
             
-            if st.button("📈 Generate Report", type="primary"):
+            generate = st.button("📈 Generate Report", type="primary")
+            # The same data is answered from the report cache; this asks Claude for a fresh take
+            regenerate = bool(st.session_state.intelligence_report) and st.button("🔄 Regenerate (fresh report)")
+            
+            if generate or regenerate:
                 with st.spinner("🤖 Generating competitive intelligence report..."):
-                    intelligence_agent = CompetitorIntelligenceAgent(api_key=ANTHROPIC_API_KEY)
+                    intelligence_agent = get_intelligence_agent(ANTHROPIC_API_KEY)
+                    use_cache = not regenerate
                     
+                    # Render the report as it streams in rather than after the full response
                     if report_type == "Full Detailed Report":
-                        report = intelligence_agent.generate_report(st.session_state.extracted_products)
+                        report_stream = intelligence_agent.stream_report(
+                            st.session_state.extracted_products, use_cache=use_cache
+                        )
                     else:
-                        report = intelligence_agent.generate_summary_report(st.session_state.extracted_products)
+                        report_stream = intelligence_agent.stream_summary_report(
+                            st.session_state.extracted_products, use_cache=use_cache
+                        )
+                    report = st.write_stream(report_stream)
                     
                     st.session_state.intelligence_report = report
                     st.session_state.intelligence_report_type = report_type
@@ -425,12 +473,11 @@ def main():
                 st.markdown(report)
                 
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                logo_path = "logo.svg" if os.path.exists("logo.svg") else None
                 report_title = "AI Powered Competitor Intelligence"
                 
                 st.subheader("Download report")
                 try:
-                    docx_bytes = export_report_to_docx(report, logo_path=logo_path, title=report_title)
+                    docx_bytes = cached_report_docx(report, LOGO_PATH, report_title)
                     st.download_button(
                         label="📝 Download Word (.docx)",
                         data=docx_bytes,
@@ -448,24 +495,31 @@ def main():
         if not st.session_state.processing_complete or not st.session_state.extracted_products:
             st.info("👈 Complete scraping first to export data")
         else:
-            all_products = st.session_state.scraper_agent.get_all_products_flat()
+            results_id = st.session_state.results_id
+            agent = st.session_state.scraper_agent
+            product_count = cached_summary_statistics(results_id, agent)["total_products"]
             
-            if all_products:
+            if product_count:
                 st.subheader("Download Products as CSV")
                 
-                csv_data = export_products_to_csv(all_products)
+                compress = st.checkbox(
+                    "Compress download (.csv.gz)",
+                    value=False,
+                    help="Much smaller download for large exports; most spreadsheet tools need it unzipped first",
+                )
+                csv_data = cached_products_csv(results_id, compress, agent)
                 
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"products_{timestamp}.csv"
+                filename = f"products_{timestamp}.csv" + (".gz" if compress else "")
                 
                 st.download_button(
                     label="📥 Download CSV File",
                     data=csv_data,
                     file_name=filename,
-                    mime="text/csv"
+                    mime="application/gzip" if compress else "text/csv"
                 )
                 
-                st.success(f"✓ Ready to export {len(all_products)} products")
+                st.success(f"✓ Ready to export {product_count} products")
             else:
                 st.warning("No products to export")
     
@@ -0,0 +1,13 @@
+import csv
+import io
+
+from utils.file_handler import export_products_to_csv
+
+
+def test_export_joins_non_string_features():
+    products = [
+        {"product_name": "A", "features": ["Cover", 2, None]},
+        {"product_name": "B", "features": "Already text"},
+    ]
+    rows = list(csv.DictReader(io.StringIO(export_products_to_csv(products).decode("utf-8"))))
+    assert [row["features"] for row in rows] == ["Cover | 2 | None", "Already text"]
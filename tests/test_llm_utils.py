@@ -0,0 +1,42 @@
+import pytest
+
+from agents.llm_utils import _parse_products_response
+
+
+@pytest.mark.parametrize(
+    "response_text, expected",
+    [
+        # Prose after the array that contains another bracketed aside
+        (
+            'Products:\n[{"product_name": "A", "features": ["x"]}]\n\nNote: [1] prices exclude VAT',
+            [{"product_name": "A", "features": ["x"]}],
+        ),
+        # Bracketed prose before the array
+        (
+            'Note: prices [in GBP] below.\n[{"product_name": "A"}]',
+            [{"product_name": "A"}],
+        ),
+        # Braces in the prose before the array
+        (
+            'Here is {the data}:\n[{"product_name": "A"}]',
+            [{"product_name": "A"}],
+        ),
+    ],
+)
+def test_prose_wrapped_replies_keep_their_products(response_text, expected):
+    assert _parse_products_response(response_text) == expected
+
+
+def test_plain_and_fenced_arrays():
+    assert _parse_products_response('[{"product_name": "A"}]') == [{"product_name": "A"}]
+    assert _parse_products_response('```json\n[{"product_name": "A"}]\n```') == [{"product_name": "A"}]
+    assert _parse_products_response("[]") == []
+
+
+def test_unparseable_reply_returns_none():
+    assert _parse_products_response("Sorry, I could not find any products on this page.") is None
+
+
+def test_repair_fallback_rescues_unquoted_keys():
+    pytest.importorskip("json_repair")
+    assert _parse_products_response('[{product_name: "A"}]') == [{"product_name": "A"}]
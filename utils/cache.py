@@ -0,0 +1,60 @@
+import copy
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from config import CACHE_ENABLED, CACHE_TTL
+
+
+class TTLCache:
+    """
+    Small in-memory cache with per-entry expiry.
+    Used to skip repeat LLM calls for inputs that were already processed this session.
+    """
+
+    def __init__(
+        self,
+        ttl: int = CACHE_TTL,
+        maxsize: int = 256,
+        enabled: bool = CACHE_ENABLED,
+        copy_values: bool = True,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.enabled = enabled
+        # Disable for values callers treat as read-only, where a deep copy would cost as much as a miss
+        self.copy_values = copy_values
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Deterministic key from string parts (NUL-separated so parts can't run together)."""
+        # BLAKE2b is faster than SHA-256 on whole pages; 128 bits is ample for a cache key
+        return hashlib.blake2b("\x00".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a copy of the cached value, or None on miss/expiry."""
+        if not self.enabled:
+            return None
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        # Callers mutate product dicts (e.g. source_url), so by default never hand out the cached object
+        return copy.deepcopy(value) if self.copy_values else value
+
+    def set(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        self._data[key] = (time.monotonic(), copy.deepcopy(value) if self.copy_values else value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
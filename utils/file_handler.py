@@ -1,22 +1,37 @@
 import csv
+import gzip
 import io
 from typing import List, Dict, Any
-import pandas as pd
 import logging
 
 logger = logging.getLogger(__name__)
 
 from utils.product_cleaner import dedupe_products
 
-def export_products_to_csv(products: List[Dict[str, Any]]) -> bytes:
+# Leading CSV columns, always present (empty when no product has them) so exports share one schema
+_PREFERRED_EXPORT_COLUMNS = (
+    "competitor",
+    "product_name",
+    "price_monthly",
+    "price_annual",
+    "excess",
+    "special_offers",
+    "category",
+    "source_url",
+)
+
+def export_products_to_csv(products: List[Dict[str, Any]], compress: bool = False) -> bytes:
     """
     Export products list to CSV format.
-    Returns bytes that can be downloaded.
+    Returns bytes that can be downloaded; with compress=True the bytes are a .csv.gz file.
     """
     if not products:
         logger.warning("No products to export")
         return b""
     
+    # pandas is only needed for exports; keep it off the upload path
+    import pandas as pd
+
     try:
         # Remove duplicates for cleaner exports (same product+price across multiple pages)
         products, _ = dedupe_products(products)
@@ -24,35 +39,28 @@ def export_products_to_csv(products: List[Dict[str, Any]]) -> bytes:
         # Create DataFrame
         df = pd.DataFrame(products)
         
-        # Reorder columns for better readability
-        preferred_columns = [
-            "competitor",
-            "product_name",
-            "price_monthly",
-            "price_annual",
-            "excess",
-            "special_offers",
-            "category",
-            "source_url"
-        ]
-        
-        # Keep preferred columns that exist, then add any others
-        existing_cols = [col for col in preferred_columns if col in df.columns]
-        other_cols = [col for col in df.columns if col not in existing_cols]
-        
-        df = df[existing_cols + other_cols]
+        # Preferred columns first, then any others in their original order
+        other_cols = [col for col in df.columns if col not in _PREFERRED_EXPORT_COLUMNS]
+        df = df.reindex(columns=[*_PREFERRED_EXPORT_COLUMNS, *other_cols])
         
         # Handle features column (list to string conversion)
         if "features" in df.columns:
-            df["features"] = df["features"].apply(
-                lambda x: " | ".join(x) if isinstance(x, list) else x
-            )
+            is_list = df["features"].map(type).eq(list)
+            if is_list.any():
+                # str() each item: the model sometimes returns numbers or null inside the list,
+                # which Series.str.join would turn into NaN for the whole cell
+                df.loc[is_list, "features"] = df.loc[is_list, "features"].map(lambda v: " | ".join(map(str, v)))
         
-        # Convert to CSV
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False)
+        # Convert to CSV, encoding straight into a bytes buffer (no intermediate str copy)
+        csv_buffer = io.BytesIO()
+        if compress:
+            # Level 1 is far cheaper than the default 9 and still shrinks tabular text several-fold
+            with gzip.GzipFile(fileobj=csv_buffer, mode="wb", compresslevel=1) as gz:
+                df.to_csv(gz, index=False, encoding="utf-8", lineterminator="\n")
+        else:
+            df.to_csv(csv_buffer, index=False, encoding="utf-8", lineterminator="\n")
         
-        return csv_buffer.getvalue().encode('utf-8')
+        return csv_buffer.getvalue()
     
     except Exception as e:
         logger.error(f"Error exporting to CSV: {e}")
@@ -67,44 +75,38 @@ def parse_csv_urls(uploaded_file) -> List[Dict[str, Any]]:
       {"url": "<url>", "competitor": "<name or None>"}
     """
     try:
-        # Read the uploaded file
-        stringio = io.StringIO(uploaded_file.getvalue().decode("utf8"), newline=None)
-        data = pd.read_csv(stringio)
+        # Positional csv.reader: only one or two columns are read, so skip building a dict per row.
+        # utf-8-sig drops the BOM Excel adds
+        reader = csv.reader(io.StringIO(uploaded_file.getvalue().decode("utf-8-sig"), newline=""))
+        header = next(reader, [])
+        # Header name -> position (a repeated name maps to its last column, as with csv.DictReader)
+        positions = {name: i for i, name in enumerate(header)}
+        columns = {name.lower(): name for name in reversed(header) if name}
 
         # Look for 'url' or 'URL' column
-        url_column = None
-        for col in data.columns:
-            if col.lower() == "url":
-                url_column = col
-                break
-
+        url_column = columns.get("url")
         if url_column is None:
-            logger.error(f"No 'url' column found. Available columns: {list(data.columns)}")
+            logger.error(f"No 'url' column found. Available columns: {header}")
             return []
+        url_idx = positions[url_column]
 
         # Optional competitor column
-        competitor_column = None
-        for col in data.columns:
-            if col.lower() in ("competitor", "competitor_name"):
-                competitor_column = col
-                break
+        competitor_column = columns.get("competitor") or columns.get("competitor_name")
+        competitor_idx = positions[competitor_column] if competitor_column is not None else None
 
         # Extract URLs (and competitor names) and remove duplicates while preserving order
         rows: List[Dict[str, Any]] = []
         seen = set()
 
-        for _, row in data.iterrows():
-            raw_url = row.get(url_column)
-            if pd.notna(raw_url):
-                url_str = str(raw_url).strip()
-                if url_str and url_str not in seen:
-                    seen.add(url_str)
-                    comp_name = None
-                    if competitor_column is not None:
-                        raw_comp = row.get(competitor_column)
-                        if pd.notna(raw_comp):
-                            comp_name = str(raw_comp).strip()
-                    rows.append({"url": url_str, "competitor": comp_name})
+        for row in reader:
+            # Short and blank rows simply lack the trailing columns
+            url_str = row[url_idx].strip() if url_idx < len(row) else ""
+            if url_str and url_str not in seen:
+                seen.add(url_str)
+                comp_name = None
+                if competitor_idx is not None and competitor_idx < len(row):
+                    comp_name = row[competitor_idx].strip() or None
+                rows.append({"url": url_str, "competitor": comp_name})
 
         logger.info(f"Parsed {len(rows)} URL rows from CSV")
         return rows
@@ -117,14 +119,9 @@ def parse_text_urls(text: str) -> List[str]:
     """
     Parse URLs from plain text (one URL per line).
     """
-    urls = []
-    seen = set()
-    
-    for line in text.strip().split('\n'):
-        url = line.strip()
-        if url and url not in seen:
-            urls.append(url)
-            seen.add(url)
+    # dict.fromkeys dedupes in one pass, keeping first-seen order
+    lines = (line.strip() for line in text.splitlines())
+    urls = list(dict.fromkeys(url for url in lines if url))
     
     logger.info(f"Parsed {len(urls)} URLs from text")
     return urls
@@ -1,24 +1,38 @@
 from __future__ import annotations
 
 import re
+from functools import lru_cache
 from typing import Any, Dict, List, Tuple
-from urllib.parse import urlparse
+from urllib.parse import urlsplit
 
+_WHITESPACE_RE = re.compile(r"\s+")
+_CURRENCY_RE = re.compile(r"[£$€]")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
 
-def _domain_from_url(url: str | None) -> str:
-    if not url:
-        return ""
+# Fields a duplicate may fill in when the first-seen row left them blank
+_FILLABLE_FIELDS = ("special_offers", "terms_conditions", "category", "features")
+
+
+@lru_cache(maxsize=4096)
+def url_netloc(url: str) -> str:
+    """Host part of a URL ('' if unparseable); cached, as the same source URLs recur across products."""
     try:
-        return urlparse(url).netloc.lower()
+        return urlsplit(url).netloc
     except Exception:
         return ""
 
 
+def _domain_from_url(url: str | None) -> str:
+    if not url:
+        return ""
+    return url_netloc(url).lower()
+
+
 def _normalize_text(value: Any) -> str:
     if value is None:
         return ""
     s = str(value).strip().lower()
-    s = re.sub(r"\s+", " ", s)
+    s = _WHITESPACE_RE.sub(" ", s)
     return s
 
 
@@ -36,9 +50,9 @@ def _normalize_money(value: Any) -> str:
     if not s:
         return ""
     # Pick first currency symbol if present
-    currency_match = re.search(r"[£$€]", s)
+    currency_match = _CURRENCY_RE.search(s)
     currency = currency_match.group(0) if currency_match else ""
-    num_match = re.search(r"[\d]+(?:\.[\d]+)?", s.replace(",", ""))
+    num_match = _NUMBER_RE.search(s.replace(",", ""))
     num = num_match.group(0) if num_match else ""
     if currency and num:
         # Preserve original precision but normalize trivial trailing dots/spaces
@@ -57,48 +71,55 @@ def dedupe_products(products: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]
     if not products:
         return [], {"input_count": 0, "output_count": 0, "duplicates_removed": 0}
 
-    seen: dict[tuple[str, str, str, str, str], Dict[str, Any]] = {}
+    # key -> (merged row, set mirror of its _source_urls list for O(1) membership on duplicate hits)
+    seen: dict[str, tuple[Dict[str, Any], set[str]]] = {}
+    input_count = 0
 
     for p in products:
         if not isinstance(p, dict):
             continue
+        input_count += 1
 
         src = p.get("source_url")
         provider = _domain_from_url(src)
+        # One unit-separator-joined string: a single str hash instead of a 5-tuple's
         key = (
-            provider,
-            _normalize_text(p.get("product_name")),
-            _normalize_money(p.get("price_monthly")),
-            _normalize_money(p.get("price_annual")),
-            _normalize_money(p.get("excess")),
+            f"{provider}\x1f{_normalize_text(p.get('product_name'))}"
+            f"\x1f{_normalize_money(p.get('price_monthly'))}"
+            f"\x1f{_normalize_money(p.get('price_annual'))}"
+            f"\x1f{_normalize_money(p.get('excess'))}"
         )
 
-        if key not in seen:
+        # Single lookup per product; a hit returns the row and its source set together
+        entry = seen.get(key)
+        if entry is None:
             # Copy so we don't mutate the original list in session state
             new_p = dict(p)
             new_p["_provider_domain"] = provider
             new_p["_source_urls"] = [src] if src else []
-            seen[key] = new_p
+            seen[key] = (new_p, {src} if src else set())
         else:
-            existing = seen[key]
-            if src and src not in existing.get("_source_urls", []):
+            existing, sources = entry
+            if src and src not in sources:
+                sources.add(src)
                 existing["_source_urls"].append(src)
 
             # Opportunistically fill blanks from later duplicates
-            for field in ("special_offers", "terms_conditions", "category"):
-                if not existing.get(field) and p.get(field):
-                    existing[field] = p.get(field)
-            if (not existing.get("features")) and p.get("features"):
-                existing["features"] = p.get("features")
-
-    deduped = list(seen.values())
-    # Replace source_url with merged URLs for display/export
+            for field in _FILLABLE_FIELDS:
+                if not existing.get(field):
+                    value = p.get(field)
+                    if value:
+                        existing[field] = value
+
+    deduped = [row for row, _ in seen.values()]
+    # Replace source_url with merged URLs for display/export; the list itself is internal only
     for p in deduped:
-        urls = p.get("_source_urls") or []
-        if urls:
+        urls = p.pop("_source_urls")
+        if len(urls) == 1:
+            p["source_url"] = urls[0]
+        elif urls:
             p["source_url"] = "\n".join(urls)
 
-    input_count = len([p for p in products if isinstance(p, dict)])
     output_count = len(deduped)
     return deduped, {
         "input_count": input_count,
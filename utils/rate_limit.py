@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import List
+
+from config import ANTHROPIC_RPM, ANTHROPIC_TPM
+
+WINDOW_SECONDS = 60.0
+
+
+class TokenRateLimiter:
+    """
+    Sliding-window limiter for requests per minute and tokens per minute.
+    Callers reserve an estimate before a request and reconcile it with the
+    real usage afterwards, so throughput follows actual token consumption
+    instead of a fixed sleep between calls.
+    Safe to share between threads and event loops.
+    """
+
+    def __init__(self, rpm: int = ANTHROPIC_RPM, tpm: int = ANTHROPIC_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        # Each reservation is [timestamp, tokens]; lists so reconcile() can adjust in place
+        self._window: "deque[List[float]]" = deque()
+        self._tokens = 0.0
+
+    def _try_reserve(self, tokens: int):
+        """Reserve capacity now, or return the seconds to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+                self._tokens -= self._window.popleft()[1]
+            # An empty window always admits one request, even one larger than the whole budget
+            if not self._window or (len(self._window) < self.rpm and self._tokens + tokens <= self.tpm):
+                reservation = [now, float(tokens)]
+                self._window.append(reservation)
+                self._tokens += tokens
+                return reservation
+            return max(0.05, WINDOW_SECONDS - (now - self._window[0][0]))
+
+    def acquire(self, tokens: int) -> List[float]:
+        """Block until `tokens` fit in the window; returns a reservation for `reconcile`."""
+        while True:
+            result = self._try_reserve(tokens)
+            if isinstance(result, list):
+                return result
+            time.sleep(result)
+
+    async def acquire_async(self, tokens: int) -> List[float]:
+        """Async counterpart of `acquire`; waits without blocking the event loop."""
+        while True:
+            result = self._try_reserve(tokens)
+            if isinstance(result, list):
+                return result
+            await asyncio.sleep(result)
+
+    def reconcile(self, reservation: List[float], actual_tokens: int) -> None:
+        """Replace a reservation's estimate with the tokens the request actually used."""
+        with self._lock:
+            if any(r is reservation for r in self._window):
+                self._tokens += actual_tokens - reservation[1]
+            reservation[1] = float(actual_tokens)
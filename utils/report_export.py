@@ -3,7 +3,9 @@ Export competitor intelligence report to Word (.docx) and PowerPoint (.pptx)
 with logo and brand theme (#d03e9d, #08216b).
 """
 import io
+import os
 import re
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, List, Tuple
 
@@ -12,10 +14,29 @@ PRIMARY_PINK = (208, 62, 157)   # #d03e9d
 PRIMARY_NAVY = (8, 33, 107)     # #08216b
 SUBTLE_BG = (245, 247, 251)    # #f5f7fb
 
+# Block markers at the start of a stripped line: "## "/"# " heading, "- "/"* " bullet, "1. " numbered item
+_BLOCK_MARKER_RE = re.compile(r"(##? )|([-*] )|(\d+\.\s)")
+# Sentence/clause boundaries used to break long paragraphs into slide bullets
+_SENT_SPLIT_RE = re.compile(r"[.;]\s+")
+# Bullet markers stripped from slide lines (all two characters long)
+_SLIDE_BULLET_PREFIXES = ("• ", "- ", "* ")
+# _condense_for_slide also drops an en-dash marker
+_CONDENSE_PREFIXES = (*_SLIDE_BULLET_PREFIXES, "– ")
+
 
 def _svg_to_png_bytes(svg_path: str) -> Optional[bytes]:
     """Convert SVG file to PNG bytes for embedding in Word/PPT. Returns None if conversion fails.
     Requires cairo system library; if missing (e.g. on Windows), returns None so export still works without logo."""
+    try:
+        mtime = os.path.getmtime(svg_path)
+    except OSError:
+        return None
+    return _rasterize_svg(svg_path, mtime)
+
+
+@lru_cache(maxsize=8)
+def _rasterize_svg(svg_path: str, mtime: float) -> Optional[bytes]:
+    """Cached by (path, mtime): every export reuses the same brand logo, and an edited file gets a fresh key."""
     try:
         import cairosvg
     except (ImportError, OSError, Exception):
@@ -32,44 +53,30 @@ def _parse_report_blocks(report_text: str) -> List[Tuple[str, str]]:
     """Parse markdown-style report into (block_type, content) list. Types: 'heading', 'paragraph', 'bullet'."""
     blocks: List[Tuple[str, str]] = []
     lines = report_text.replace("\r\n", "\n").split("\n")
-    i = 0
-    while i < len(lines):
-        line = lines[i]
+    # Single pass: each line is stripped and classified once; paragraph lines buffer until a break
+    para_lines: List[str] = []
+    for line in lines:
         stripped = line.strip()
-        # ## Section heading
-        if stripped.startswith("## "):
-            blocks.append(("heading", stripped[3:].strip()))
-            i += 1
+        marker = _BLOCK_MARKER_RE.match(stripped) if stripped else None
+        if stripped and marker is None:
+            para_lines.append(stripped)
             continue
-        # # Heading (treat as heading level 2)
-        if stripped.startswith("# ") and not stripped.startswith("## "):
-            blocks.append(("heading", stripped[2:].strip()))
-            i += 1
+        # Empty line, heading or bullet ends the current paragraph
+        if para_lines:
+            blocks.append(("paragraph", " ".join(para_lines)))
+            para_lines = []
+        if marker is None:
             continue
-        # Bullet: - or * at start
-        if stripped.startswith("- ") or stripped.startswith("* "):
+        heading, bullet, numbered = marker.groups()
+        if heading:
+            # "## Section" or "# Heading" (both treated as level 2)
+            blocks.append(("heading", stripped[len(heading):].strip()))
+        elif bullet:
             blocks.append(("bullet", stripped[2:].strip()))
-            i += 1
-            continue
-        # Numbered line (e.g. "1. British Gas snapshot")
-        if re.match(r"^\d+\.\s", stripped):
+        else:
+            # Numbered line (e.g. "1. British Gas snapshot") keeps its number
             blocks.append(("bullet", stripped))
-            i += 1
-            continue
-        # Empty line
-        if not stripped:
-            i += 1
-            continue
-        # Paragraph: collect consecutive non-bullet/non-heading lines
-        para_lines = [stripped]
-        i += 1
-        while i < len(lines):
-            next_line = lines[i]
-            next_stripped = next_line.strip()
-            if not next_stripped or next_stripped.startswith("## ") or next_stripped.startswith("# ") or next_stripped.startswith("- ") or next_stripped.startswith("* ") or re.match(r"^\d+\.\s", next_stripped):
-                break
-            para_lines.append(next_stripped)
-            i += 1
+    if para_lines:
         blocks.append(("paragraph", " ".join(para_lines)))
     return blocks
 
@@ -125,11 +132,14 @@ def export_report_to_docx(report_text: str, logo_path: Optional[str] = None, tit
     return buffer.read()
 
 
+# RGBColor values are immutable tuples, so each theme colour is imported and built once per process
+@lru_cache(maxsize=16)
 def _rgb_to_docx(rgb: Tuple[int, int, int]):
     from docx.shared import RGBColor
     return RGBColor(*rgb)
 
 
+@lru_cache(maxsize=16)
 def _rgb_to_pptx(rgb: Tuple[int, int, int]):
     from pptx.dml.color import RGBColor
     return RGBColor(*rgb)
@@ -141,10 +151,8 @@ def _condense_for_slide(line: str, max_len: int = 72) -> str:
     if not line:
         return ""
     # Remove leading bullet/asterisk
-    for prefix in ("• ", "- ", "* ", "– "):
-        if line.startswith(prefix):
-            line = line[len(prefix):].strip()
-            break
+    if line[:2] in _CONDENSE_PREFIXES:
+        line = line[2:].strip()
     if len(line) <= max_len:
         return line
     # Prefer break at last space before max_len
@@ -159,16 +167,13 @@ def _content_to_slide_bullets(content_list: List[str], max_bullets_per_slide: in
     bullets: List[str] = []
     for line in content_list:
         line = line.strip()
-        for prefix in ("• ", "- ", "* "):
-            if line.startswith(prefix):
-                line = line[len(prefix):].strip()
-                break
+        if line[:2] in _SLIDE_BULLET_PREFIXES:
+            line = line[2:].strip()
         if not line:
             continue
         # One long paragraph → split into short bullets by sentence or length
         if len(line) > 120:
-            parts = re.split(r"[.;]\s+", line)
-            for part in parts:
+            for part in _SENT_SPLIT_RE.split(line):
                 part = part.strip()
                 if part:
                     bullets.append(_condense_for_slide(part, max_len=78))
@@ -230,11 +235,14 @@ def export_report_to_pptx(report_text: str, logo_path: Optional[str] = None, tit
             except Exception:
                 pass
 
+    # One stream for every slide: add_picture rewinds it, and the package stores the image part only once
+    logo_stream = io.BytesIO(logo_bytes) if logo_bytes else None
+
     def add_logo(slide, left: float, top: float, width: float = 1.25):
-        if not logo_bytes:
+        if logo_stream is None:
             return
         try:
-            slide.shapes.add_picture(io.BytesIO(logo_bytes), Inches(left), Inches(top), width=Inches(width))
+            slide.shapes.add_picture(logo_stream, Inches(left), Inches(top), width=Inches(width))
         except Exception:
             return
 
@@ -1,8 +1,29 @@
 import pandas as pd
 from typing import List, Dict, Any
-from urllib.parse import urlparse
 
-from utils.product_cleaner import dedupe_products
+from utils.product_cleaner import dedupe_products, url_netloc
+
+# Display column order (first column: provider/competitor name) and headers
+_DISPLAY_NAMES = {
+    "competitor": "Provider",
+    "product_name": "Product Name",
+    "price_monthly": "Monthly Price",
+    "price_annual": "Annual Price",
+    "excess": "Excess",
+    "special_offers": "Special Offers",
+    "category": "Category",
+    "coverage_and_tcs": "Coverage and T&Cs",
+}
+_PREFERRED_DISPLAY_COLUMNS = tuple(_DISPLAY_NAMES)
+
+# Internal-only / redundant fields we don't want to display
+_HIDDEN_COLUMNS = frozenset({
+    "provider",
+    "source_url",
+    "features",
+    "terms_conditions",
+    "_provider_domain",
+})
 
 
 def _provider_from_source_url(source_url: Any) -> str:
@@ -10,32 +31,19 @@ def _provider_from_source_url(source_url: Any) -> str:
         return ""
     # source_url may be newline-joined after dedupe; take first URL for provider label
     first = str(source_url).splitlines()[0].strip()
-    try:
-        return urlparse(first).netloc
-    except Exception:
-        return ""
+    return url_netloc(first)
 
 
-def _ensure_competitor_column(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Ensure a 'competitor' column exists for display:
-    - Prefer existing 'competitor' field (from CSV)
-    - Fall back to domain derived from 'source_url' when missing/blank
-    """
-    if "competitor" not in df.columns:
-        if "source_url" in df.columns:
-            df["competitor"] = df["source_url"].apply(_provider_from_source_url)
-        else:
-            df["competitor"] = ""
-    else:
-        if "source_url" in df.columns:
-            df["competitor"] = df.apply(
-                lambda row: row["competitor"]
-                if isinstance(row.get("competitor"), str) and row["competitor"].strip()
-                else _provider_from_source_url(row.get("source_url")),
-                axis=1,
-            )
-    return df
+def _features_text(feats: Any) -> str:
+    if isinstance(feats, list):
+        return "\n".join(f"• {f}" for f in feats)
+    if isinstance(feats, str):
+        return feats.strip()
+    return ""
+
+
+def _stripped_text(value: Any) -> str:
+    return value.strip() if isinstance(value, str) else ""
 
 
 def format_products_as_dataframe(products: List[Dict[str, Any]], dedupe: bool = True) -> pd.DataFrame:
@@ -48,77 +56,44 @@ def format_products_as_dataframe(products: List[Dict[str, Any]], dedupe: bool =
     if dedupe:
         products, _ = dedupe_products(products)
 
-    # Create DataFrame
-    df = pd.DataFrame(products)
-
-    # Ensure competitor column exists (from CSV or URL domain)
-    df = _ensure_competitor_column(df)
-
-    # Build combined "Coverage and T&Cs" column from features + terms_conditions
-    if "features" in df.columns or "terms_conditions" in df.columns:
-        def _combine_coverage(row: Dict[str, Any]) -> str:
-            parts = []
-            feats = row.get("features")
-            if isinstance(feats, list):
-                feat_str = "\n".join(f"• {f}" for f in feats)
-                if feat_str:
-                    parts.append(feat_str)
-            elif isinstance(feats, str) and feats.strip():
-                parts.append(feats.strip())
-
-            tc = row.get("terms_conditions")
-            if isinstance(tc, str) and tc.strip():
-                parts.append(tc.strip())
-
-            return "\n\n".join(parts) if parts else ""
-
-        df["coverage_and_tcs"] = df.apply(_combine_coverage, axis=1)
-
-    # Drop internal-only / now-redundant columns we don't want to display
-    drop_cols = [
-        "provider",
-        "source_url",
-        "features",
-        "terms_conditions",
-        "_provider_domain",
-        "_source_urls",
-    ]
-    existing_drop = [c for c in drop_cols if c in df.columns]
-    if existing_drop:
-        df = df.drop(columns=existing_drop)
-
-    # Define display column order (first column: provider/competitor name)
-    preferred_columns = [
-        "competitor",
-        "product_name",
-        "price_monthly",
-        "price_annual",
-        "excess",
-        "special_offers",
-        "category",
-        "coverage_and_tcs",
-    ]
-
-    # Reorder columns
-    existing_cols = [col for col in preferred_columns if col in df.columns]
-    other_cols = [col for col in df.columns if col not in existing_cols]
-    df = df[existing_cols + other_cols]
-
-    # Rename columns for display
-    column_mapping = {
-        "competitor": "Provider",
-        "product_name": "Product Name",
-        "price_monthly": "Monthly Price",
-        "price_annual": "Annual Price",
-        "excess": "Excess",
-        "special_offers": "Special Offers",
-        "category": "Category",
-        "coverage_and_tcs": "Coverage and T&Cs",
-    }
-
-    df = df.rename(columns=column_mapping)
-
-    return df
+    # Every key seen across products, in first-seen order (as pd.DataFrame(products) would lay out columns)
+    keys = dict.fromkeys(k for p in products for k in p)
+    has_source = "source_url" in keys
+
+    # Provider: existing 'competitor' field (from CSV), else domain derived from 'source_url'
+    if "competitor" in keys:
+        competitor = []
+        for p in products:
+            name = p.get("competitor")
+            if has_source and not (isinstance(name, str) and name.strip()):
+                name = _provider_from_source_url(p.get("source_url"))
+            competitor.append(name)
+    elif has_source:
+        competitor = [_provider_from_source_url(p.get("source_url")) for p in products]
+    else:
+        competitor = [""] * len(products)
+
+    columns: Dict[str, List[Any]] = {"competitor": competitor}
+    for col in _PREFERRED_DISPLAY_COLUMNS[1:-1]:
+        if col in keys:
+            columns[col] = [p.get(col) for p in products]
+
+    # Combined "Coverage and T&Cs" column from features + terms_conditions
+    if "features" in keys or "terms_conditions" in keys:
+        coverage = []
+        for p in products:
+            feat = _features_text(p.get("features"))
+            tc = _stripped_text(p.get("terms_conditions"))
+            # Blank line between the two parts only when both are present
+            coverage.append(f"{feat}\n\n{tc}" if feat and tc else feat + tc)
+        columns["coverage_and_tcs"] = coverage
+
+    # Remaining fields after the display columns; internal-only / redundant ones are never built
+    for col in keys:
+        if col not in columns and col not in _HIDDEN_COLUMNS:
+            columns[col] = [p.get(col) for p in products]
+
+    return pd.DataFrame({_DISPLAY_NAMES.get(col, col): values for col, values in columns.items()})
 
 def format_summary_statistics(stats: Dict[str, Any]) -> pd.DataFrame:
     """
@@ -143,13 +118,14 @@ def format_summary_statistics(stats: Dict[str, Any]) -> pd.DataFrame:
     
     return pd.DataFrame(stats_list)
 
-def format_errors_as_dataframe(errors: List[Dict[str, str]]) -> pd.DataFrame:
+def format_errors_as_dataframe(errors: List[Any]) -> pd.DataFrame:
     """
-    Format errors list as a DataFrame for display.
+    Format errors list (ScrapeError records with .url / .error) as a DataFrame for display.
     """
     if not errors:
         return pd.DataFrame()
     
-    df = pd.DataFrame(errors)
-    df = df.rename(columns={"url": "URL", "error": "Error"})
-    return df
\ No newline at end of file
+    return pd.DataFrame({
+        "URL": [e.url for e in errors],
+        "Error": [e.error for e in errors],
+    })
\ No newline at end of file
@@ -4,30 +4,36 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+_URL_RE = re.compile(
+    r'^https?://'  # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain
+    r'localhost|'  # localhost
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # IP
+    r'(?::\d+)?'  # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
 def validate_url(url: str) -> bool:
     """Validate if a string is a proper URL."""
-    url_pattern = re.compile(
-        r'^https?://'  # http:// or https://
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain
-        r'localhost|'  # localhost
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # IP
-        r'(?::\d+)?'  # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    return url_pattern.match(url) is not None
+    # Cheap scheme check first; most junk lines fail here without touching the regex
+    if not url[:8].lower().startswith(("http://", "https://")):
+        return False
+    return _URL_RE.match(url) is not None
 
 def process_urls_from_text(text: str) -> Tuple[List[str], List[str]]:
     """
     Extract URLs from text (one per line).
-    Returns tuple of (valid_urls, invalid_urls)
+    Returns tuple of (valid_urls, invalid_urls); valid_urls is already de-duplicated.
     """
     lines = text.strip().split('\n')
     valid_urls = []
     invalid_urls = []
+    seen = set()
     
     for line in lines:
         url = line.strip()
-        if url:  # Skip empty lines
+        if url and url not in seen:  # Skip empty lines and URLs already accepted
             if validate_url(url):
+                seen.add(url)
                 valid_urls.append(url)
             else:
                 invalid_urls.append(url)
@@ -38,24 +44,30 @@ def process_urls_from_csv(csv_content: str, url_column: str = "url") -> Tuple[Li
     """
     Extract URLs from CSV content.
     Assumes first row is header with 'url' or specified column name.
-    Returns tuple of (valid_urls, invalid_urls)
+    Returns tuple of (valid_urls, invalid_urls); valid_urls is already de-duplicated.
     """
     import csv
     from io import StringIO
     
     valid_urls = []
     invalid_urls = []
+    seen = set()
     
     try:
-        reader = csv.DictReader(StringIO(csv_content))
-        if not reader.fieldnames or url_column not in reader.fieldnames:
+        # Positional reader: only one column is needed, so skip building a dict per row
+        reader = csv.reader(StringIO(csv_content))
+        header = next(reader, None)
+        if not header or url_column not in header:
             logger.error(f"CSV does not contain '{url_column}' column")
             return valid_urls, invalid_urls
+        # Last matching column, as csv.DictReader would resolve a repeated header
+        idx = len(header) - 1 - header[::-1].index(url_column)
         
         for row in reader:
-            url = row.get(url_column, "").strip()
-            if url:
+            url = row[idx].strip() if idx < len(row) else ""
+            if url and url not in seen:
                 if validate_url(url):
+                    seen.add(url)
                     valid_urls.append(url)
                 else:
                     invalid_urls.append(url)
@@ -67,10 +79,4 @@ def process_urls_from_csv(csv_content: str, url_column: str = "url") -> Tuple[Li
 
 def deduplicate_urls(urls: List[str]) -> List[str]:
     """Remove duplicate URLs while preserving order."""
-    seen = set()
-    result = []
-    for url in urls:
-        if url not in seen:
-            seen.add(url)
-            result.append(url)
-    return result
\ No newline at end of file
+    return list(dict.fromkeys(urls))
\ No newline at end of file